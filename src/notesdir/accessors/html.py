@@ -2,9 +2,11 @@
 
 from collections import defaultdict
 from datetime import datetime
+from io import BytesIO
 from typing import Set
 
 from bs4 import BeautifulSoup, Tag
+from lxml import etree
 
 from notesdir.accessors.base import Accessor, ChangeError, ParseError
 from notesdir.models import AddTagCmd, DelTagCmd, FileInfo, FileEditCmd, SetTitleCmd, SetCreatedCmd, ReplaceHrefCmd,\
@@ -12,6 +14,8 @@ from notesdir.models import AddTagCmd, DelTagCmd, FileInfo, FileEditCmd, SetTitl
 
 _DATE_FORMAT = '%Y-%m-%d %H:%M:%S %z'
 
+_INFO_TAGS = ('title', 'meta', 'a', 'img', 'video', 'audio', 'source')
+
 
 class HTMLAccessor(Accessor):
     """Responsible for parsing and updating HTML files.
@@ -26,10 +30,55 @@ class HTMLAccessor(Accessor):
 
     If the file does not at least contain an ``<html>`` element, attempting to add metadata will fail.
 
-    BeautifulSoup4 is used for parsing and updating the files; formatting may be changed during updates.
+    Metadata is read by streaming through the file with lxml. BeautifulSoup4 is used for updating the files;
+    formatting may be changed during updates.
     """
     def _load(self):
-        with open(self.path, 'r') as file:
+        # Reading metadata only needs a handful of elements, so this streams through the document with lxml instead
+        # of building a BeautifulSoup tree. The tree is built by _load_page if the file is edited.
+        self._page = None
+        self._title_text = None
+        self._keywords_text = None
+        self._created_text = None
+        self._hrefs = set()
+        with open(self.path, 'rb') as file:
+            data = file.read()
+        if not data.strip():
+            return
+        seen_meta = set()
+        try:
+            # Files are always read and written as UTF-8 (see _load_page and _save), regardless of any declared
+            # charset, so that this sees the same text as an edit would; invalid files are rejected rather than
+            # being parsed with replacement characters.
+            data.decode('utf-8')
+            for _, el in etree.iterparse(BytesIO(data), events=('end',), tag=_INFO_TAGS, html=True, encoding='utf-8'):
+                tag = el.tag
+                if tag == 'a':
+                    href = el.get('href')
+                    if href:
+                        self._hrefs.add(href)
+                elif tag == 'title':
+                    if self._title_text is None:
+                        self._title_text = ''.join(el.itertext())
+                elif tag == 'meta':
+                    name = el.get('name')
+                    if name in ('keywords', 'created') and name not in seen_meta:
+                        seen_meta.add(name)
+                        if name == 'keywords':
+                            self._keywords_text = el.get('content', '')
+                        else:
+                            self._created_text = el.get('content')
+                else:
+                    src = el.get('src')
+                    if src:
+                        self._hrefs.add(src)
+                    # TODO srcset attribute
+                el.clear()
+        except Exception as e:
+            raise ParseError('Cannot parse HTML', self.path, e)
+
+    def _load_page(self):
+        with open(self.path, 'r', encoding='utf-8') as file:
             try:
                 self._page = BeautifulSoup(file, 'lxml')
             except Exception as e:
@@ -50,14 +99,25 @@ class HTMLAccessor(Accessor):
         self._head_el = None
         self._html_el = None
 
+    def _edit(self, edit: FileEditCmd) -> None:
+        if self._page is None:
+            self._load_page()
+        super()._edit(edit)
+
     def _info(self, info: FileInfo):
+        if self._page is None:
+            info.title = self._title_text
+            info.created = datetime.strptime(self._created_text, _DATE_FORMAT) if self._created_text else None
+            info.tags = self._parse_tags(self._keywords_text)
+            info.links = [LinkInfo(self.path, href) for href in sorted(self._hrefs)]
+            return
         info.title = self._title()
         info.created = self._created()
         info.tags = self._tags()
         info.links = [LinkInfo(self.path, href) for href in sorted(self._link_els.keys())]
 
     def _save(self):
-        with open(self.path, 'w') as file:
+        with open(self.path, 'w', encoding='utf-8') as file:
             file.write(str(self._page))
 
     def _get_head_el(self, edit: FileEditCmd) -> Tag:
@@ -74,11 +134,16 @@ class HTMLAccessor(Accessor):
                 raise ChangeError(f'File does not contain root <html> element', [edit])
         return self._html_el
 
+    @staticmethod
+    def _parse_tags(keywords: str) -> Set[str]:
+        if not keywords:
+            return set()
+        return {t.strip() for t in keywords.lower().split(',') if t.strip()}
+
     def _tags(self) -> Set[str]:
         if not self._keywords_el:
             return set()
-        return {t.strip() for t in self._keywords_el.attrs.get('content', '').lower().split(',')
-                if t.strip()}
+        return self._parse_tags(self._keywords_el.attrs.get('content', ''))
 
     def _add_tag(self, edit: AddTagCmd):
         tag = edit.value.lower()
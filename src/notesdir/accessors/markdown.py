@@ -1,8 +1,13 @@
 import re
+import sys
 from io import StringIO
-from typing import Set, Tuple, List
+from typing import Dict, Set, Tuple, List
 
 import yaml
+try:
+    from yaml import CSafeDumper as _YamlDumper, CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeDumper as _YamlDumper, SafeLoader as _YamlLoader
 
 from notesdir.accessors.base import Accessor
 from notesdir.models import AddTagCmd, DelTagCmd, FileInfo, SetTitleCmd, SetCreatedCmd, ReplaceHrefCmd, LinkInfo
@@ -15,52 +20,78 @@ FENCED_CODE_RE = re.compile(r'(?ms)^\s*```.*?^\s*```')
 
 
 def _extract_meta(doc) -> Tuple[dict, str]:
+    if not doc.startswith('---\n'):
+        # most notes have no metadata block, and YAML_META_RE could not match one anyway
+        return {}, doc
     meta = {}
     match = YAML_META_RE.match(doc)
-    if match.groups()[1]:
-        meta = yaml.safe_load(match.groups()[1])
-    body = match.groups()[3]
-    return meta, body
+    yaml_text = match.group(2)
+    if yaml_text:
+        meta = yaml.load(yaml_text, Loader=_YamlLoader)
+    return meta, match.group(4)
 
 
 def _extract_hashtags(doc) -> Set[str]:
-    return {t[1].lower() for t in TAG_RE.findall(doc)}
+    if '#' not in doc:
+        return set()
+    return {sys.intern(m.group(2).lower()) for m in TAG_RE.finditer(doc)}
 
 
 def _remove_hashtag(doc: str, tag: str) -> str:
-    # TODO probably would be better to build a customized regex like replace_ref does
-    def replace(match):
+    pieces = []
+    prev = 0
+    for match in TAG_RE.finditer(doc):
         if match.group(2).lower() == tag:
-            return match.group(1)
-        else:
-            return match.group(0)
-    return re.sub(TAG_RE, replace, doc)
+            # keep the whitespace preceding the hashtag
+            pieces.append(doc[prev:match.end(1)])
+            prev = match.end()
+    if not pieces:
+        return doc
+    pieces.append(doc[prev:])
+    return ''.join(pieces)
 
 
 def _extract_hrefs(doc) -> List[str]:
+    if '[' not in doc:
+        # both link syntaxes start with a bracket
+        return []
     return INLINE_HREF_RE.findall(doc) + REFSTYLE_HREF_RE.findall(doc)
 
 
-def _replace_href(doc: str, src: str, dest: str) -> str:
-    escaped_src = re.escape(src)
-
-    def inline_replacement(match):
-        return f'{match.group(1)}({dest})'
+def _replace_hrefs(doc: str, replacements: Dict[str, str]) -> str:
+    """Replaces each link whose href is a key in the dict with the corresponding value, in a single pass."""
+    if not any(href in doc for href in replacements):
+        # a plain substring search is much cheaper than running the link patterns over the document
+        return doc
+    spans = []
+    for regex in (INLINE_HREF_RE, REFSTYLE_HREF_RE):
+        for match in regex.finditer(doc):
+            href = match.group(1)
+            if href in replacements:
+                spans.append((match.start(1), match.end(1), replacements[href]))
+    if not spans:
+        return doc
+    spans.sort()
+    pieces = []
+    prev = 0
+    for start, end, replacement in spans:
+        if start < prev:
+            continue
+        pieces.append(doc[prev:start])
+        pieces.append(replacement)
+        prev = end
+    pieces.append(doc[prev:])
+    return ''.join(pieces)
 
-    def refstyle_replacement(match):
-        return f'{match.group(1)}{dest}{match.group(2)}'
 
-    inline = rf'(\[.*\])\({escaped_src}\)'
-    doc = re.sub(inline, inline_replacement, doc)
-    refstyle = rf'(?m)(^\[.*\]:\s*){escaped_src}(\s|$)'
-    doc = re.sub(refstyle, refstyle_replacement, doc)
-    return doc
+def _replace_href(doc: str, src: str, dest: str) -> str:
+    return _replace_hrefs(doc, {src: dest})
 
 
 def _split(doc: str) -> List[Tuple[bool, str]]:
     result = []
     prev = 0
-    for match in re.finditer(FENCED_CODE_RE, doc):
+    for match in FENCED_CODE_RE.finditer(doc):
         start, end = match.span()
         result.append((True, doc[prev:start]))
         result.append((False, match.group()))
@@ -105,40 +136,47 @@ class MarkdownAccessor(Accessor):
        This is a really #uninteresting note.
     """
     def _load(self):
-        with open(self.path, 'r') as file:
+        with open(self.path, 'r', encoding='utf-8') as file:
             text = file.read()
         self.meta, body = _extract_meta(text)
         self.parts = _split(body)
         self.hrefs = []
         self._hashtags = set()
+        self._pending_hrefs = {}
         for parsable, part in self.parts:
             if parsable:
                 self.hrefs.extend(_extract_hrefs(part))
                 self._hashtags.update(_extract_hashtags(part))
+        self.hrefs.sort()
 
     def _info(self, info: FileInfo):
+        self._apply_pending_hrefs()
         info.title = self.meta.get('title')
         info.created = self.meta.get('created')
-        info.tags = {k.lower() for k in self.meta.get('keywords', [])}.union(self._hashtags)
-        info.links = [LinkInfo(self.path, r) for r in sorted(self.hrefs)]
+        info.tags = {sys.intern(k.lower()) for k in self.meta.get('keywords', [])}.union(self._hashtags)
+        path = self.path
+        info.links = [LinkInfo(path, r) for r in self.hrefs]
 
     def _save(self):
+        self._apply_pending_hrefs()
         body = ''.join(part for _, part in self.parts)
         if self.meta:
             sio = StringIO()
-            yaml.safe_dump(self.meta, sio)
+            yaml.dump(self.meta, sio, Dumper=_YamlDumper)
             # include a blank line between metadata and body
             text = f'---\n{sio.getvalue()}---\n\n{body}'
         else:
             text = body
-        with open(self.path, 'w') as file:
+        with open(self.path, 'w', encoding='utf-8') as file:
             file.write(text)
 
     def _add_tag(self, edit: AddTagCmd):
         tag = edit.value.lower()
         # TODO probably isn't great that this will duplicate a tag into the keywords when it's
         #      already in the body as a hashtag
-        self.edited = self.edited or tag not in self.meta.get('keywords', [])
+        if tag in self.meta.get('keywords', []):
+            return
+        self.edited = True
         if 'keywords' in self.meta:
             self.meta['keywords'].append(tag)
             self.meta['keywords'].sort()
@@ -162,18 +200,31 @@ class MarkdownAccessor(Accessor):
             self.edited = True
 
     def _set_title(self, edit: SetTitleCmd):
-        self.edited = self.edited or not self.meta.get('title') == edit.value
+        if self.meta.get('title') == edit.value:
+            return
+        self.edited = True
         self.meta['title'] = edit.value
 
     def _set_created(self, edit: SetCreatedCmd):
-        self.edited = self.edited or not self.meta.get('created') == edit.value
+        if self.meta.get('created') == edit.value:
+            return
+        self.edited = True
         self.meta['created'] = edit.value
 
     def _replace_href(self, edit: ReplaceHrefCmd):
         if edit.original not in self.hrefs:
             return
         self.edited = True
+        # Replacements are collected so that the document only has to be scanned once, no matter how many links
+        # change. As when they were applied one at a time, the first replacement for a given href wins.
+        self._pending_hrefs.setdefault(edit.original, edit.replacement)
+
+    def _apply_pending_hrefs(self):
+        if not self._pending_hrefs:
+            return
         for i in range(len(self.parts)):
             parsable, part = self.parts[i]
             if parsable:
-                self.parts[i] = (True, _replace_href(part, edit.original, edit.replacement))
+                self.parts[i] = (True, _replace_hrefs(part, self._pending_hrefs))
+        self.hrefs = sorted(self._pending_hrefs.get(href, href) for href in self.hrefs)
+        self._pending_hrefs = {}
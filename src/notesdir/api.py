@@ -69,9 +69,10 @@ class Notesdir:
         """
         info = self.repo.info(original, FileInfoReq(path=True, backlinks=True))
         edits = []
+        realpaths = {}
         for link in info.backlinks:
             # TODO group links from the same referrer for this call
-            edits.extend(edits_for_path_replacement(link.referrer, {link.href}, replacement))
+            edits.extend(edits_for_path_replacement(link.referrer, {link.href}, replacement, realpaths))
         if edits:
             self.repo.change(edits)
 
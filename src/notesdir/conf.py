@@ -6,6 +6,10 @@ from typing import Callable, Set, Optional
 from notesdir.models import FileInfo, DependentPathFn
 
 
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9]')
+_DASHES_RE = re.compile(r'-+')
+
+
 def default_ignore(parentpath: str, filename: str) -> bool:
     return filename.startswith('.') or filename.endswith('.icloud')
 
@@ -76,8 +80,8 @@ def rewrite_name_using_title(info: FileInfo) -> str:
         parent, filename = os.path.split(info.path)
         suffix = os.path.splitext(filename)[1]
         title = info.title.lower()[:60]
-        title = re.sub(r'[^a-z0-9]', '-', title)
-        title = re.sub(r'-+', '-', title)
+        title = _NON_ALNUM_RE.sub('-', title)
+        title = _DASHES_RE.sub('-', title)
         title = title.strip('-')
         return os.path.join(parent, f'{title}{suffix}')
     else:
@@ -145,6 +149,14 @@ class RepoConf:
 @dataclass
 class DirectRepoConf(RepoConf):
     """Configures notesdir to access notes without caching, via :class:`notesdir.repos.DirectRepo`."""
+
+    max_workers: Optional[int] = None
+    """Maximum number of threads used to parse files in parallel, when running queries or looking up backlinks.
+
+    The default is chosen the same way as for :class:`concurrent.futures.ThreadPoolExecutor`. Set it to 1 to parse
+    files one at a time on the calling thread.
+    """
+
     def instantiate(self):
         from notesdir.repos.direct import DirectRepo
         return DirectRepo(self.standardize())
@@ -159,7 +171,11 @@ class SqliteRepoConf(DirectRepoConf):
     
     The file will be created if it does not exist.
     The file is only a cache; you can safely delete it when the tool is not running, though you will then have to
-    wait for the cache to be rebuilt the next time you run the tool."""
+    wait for the cache to be rebuilt the next time you run the tool.
+
+    The database uses SQLite's write-ahead log, so ``-wal`` and ``-shm`` files may also appear next to it (for
+    example ``notes.sqlite3-wal``); delete those along with it. The write-ahead log relies on shared memory, so this
+    path should be on a local disk rather than a network share or a synced folder such as iCloud Drive."""
 
     def instantiate(self):
         from notesdir.repos.sqlite import SqliteRepo
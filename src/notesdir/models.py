@@ -373,13 +373,15 @@ class FileQuery:
 
     def apply_filtering(self, infos: Iterable[FileInfo]) -> Iterator[FileInfo]:
         """Yields the entries from the given iterable which match the criteria of this query."""
+        include_tags = self.include_tags
+        exclude_tags = self.exclude_tags
         for info in infos:
             if not info:
                 # TODO should probably log a warning
                 continue
-            if self.include_tags and not self.include_tags.issubset(info.tags):
+            if include_tags and not include_tags.issubset(info.tags):
                 continue
-            if self.exclude_tags and not self.exclude_tags.isdisjoint(info.tags):
+            if exclude_tags and not exclude_tags.isdisjoint(info.tags):
                 continue
             yield info
 
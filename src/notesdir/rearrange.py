@@ -4,10 +4,10 @@ Generally, you should use :meth:`notesdir.api.Notesdir.move` or :meth:`notesdir.
 instead of using anything in this module directly.
 """
 
-from glob import glob
+import os
 import os.path
 from tempfile import mkstemp
-from typing import Dict, Iterator, Set
+from typing import Dict, Iterator, Optional, Set
 from urllib.parse import ParseResult, quote, urlunparse, urlparse
 import shortuuid
 from notesdir.models import MoveCmd, ReplaceHrefCmd, FileEditCmd, FileInfoReq
@@ -63,9 +63,63 @@ def href_path(src: str, dest: str) -> str:
 
     src and dest are resolved before calculating the relative path.
     """
+    same_dir = _same_dir_href(src, dest)
+    if same_dir:
+        return same_dir
     src = os.path.split(os.path.realpath(src))[0]
     dest = os.path.realpath(dest)
-    return os.path.relpath(dest, src)
+    return _relpath(dest, src)
+
+
+def _same_dir_href(src: str, dest: str) -> Optional[str]:
+    """Returns the filename of dest if src and dest are in the same directory, which is the most common case.
+
+    Returns None when that cannot be determined without resolving the paths, in which case the caller must do so.
+    """
+    src_dir, src_name = os.path.split(src)
+    dest_dir, dest_name = os.path.split(dest)
+    if (src_dir == dest_dir and src_name not in ('', '.', '..') and dest_name not in ('', '.', '..')
+            and not os.path.islink(src) and not os.path.islink(dest)):
+        return dest_name
+    return None
+
+
+def _relpath(path: str, start: str) -> str:
+    """Equivalent to os.path.relpath for paths that are already absolute and normalized.
+
+    This compares path components directly, skipping the normalization that os.path.relpath repeats on every call.
+    """
+    if not os.sep == '/':
+        return os.path.relpath(path, start)
+    path_parts = [p for p in path.split('/') if p]
+    start_parts = [p for p in start.split('/') if p]
+    common = 0
+    for path_part, start_part in zip(path_parts, start_parts):
+        if not path_part == start_part:
+            break
+        common += 1
+    return '/'.join(['..'] * (len(start_parts) - common) + path_parts[common:]) or '.'
+
+
+def _realpath(path: str, realpaths: Dict[str, str]) -> str:
+    """Same as os.path.realpath, but remembers results in the given dict.
+
+    The dict should only be kept for one batch of work, since the filesystem may change in between.
+    """
+    result = realpaths.get(path)
+    if result is None:
+        result = realpaths[path] = os.path.realpath(path)
+    return result
+
+
+def _href_path(src: str, dest: str, realpaths: Dict[str, str]) -> str:
+    """Same as :func:`href_path`, but uses :func:`_realpath`."""
+    same_dir = _same_dir_href(src, dest)
+    if same_dir:
+        return same_dir
+    src = os.path.split(_realpath(src, realpaths))[0]
+    dest = _realpath(dest, realpaths)
+    return _relpath(dest, src)
 
 
 def path_as_href(path: str, into_url: ParseResult = None) -> str:
@@ -86,6 +140,24 @@ def path_as_href(path: str, into_url: ParseResult = None) -> str:
     return urlpath
 
 
+def _descendant_paths(dirpath: str) -> Iterator[str]:
+    """Yields the paths of all files and folders inside the given folder, recursively.
+
+    Like ``glob('**/*', recursive=True)``, names beginning with a period are skipped. Unlike glob, symlinks to
+    folders are yielded but not descended into, since their contents do not move along with the symlink (and could
+    form a loop).
+    """
+    pending = [dirpath]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                yield entry.path
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+
+
 def edits_for_raw_moves(renames: Dict[str, str]) -> Iterator[MoveCmd]:
     """Yields commands that will rename a set of files/folders.
 
@@ -109,11 +181,18 @@ def edits_for_raw_moves(renames: Dict[str, str]) -> Iterator[MoveCmd]:
     yield from phase2
 
 
-def edits_for_path_replacement(referrer: str, hrefs: Set[str], replacement: str) -> Iterator[ReplaceHrefCmd]:
-    """Yields commands to replace a file's links to a path with links to another path."""
+def edits_for_path_replacement(referrer: str, hrefs: Set[str], replacement: str,
+                               realpaths: Dict[str, str] = None) -> Iterator[ReplaceHrefCmd]:
+    """Yields commands to replace a file's links to a path with links to another path.
+
+    When calling this for many referrers in one batch, pass the same (initially empty) dict as ``realpaths`` to each
+    call, so that resolved paths are reused instead of being looked up on the filesystem again.
+    """
+    if realpaths is None:
+        realpaths = {}
     for href in hrefs:
         url = urlparse(href)
-        newref = path_as_href(href_path(referrer, replacement), url)
+        newref = path_as_href(_href_path(referrer, replacement, realpaths), url)
         yield ReplaceHrefCmd(referrer, href, newref)
 
 
@@ -125,23 +204,26 @@ def edits_for_rearrange(store: Repo, renames: Dict[str, str]) -> Iterator[FileEd
     as a value, it will be moved to a temporary file as an intermediate step.)
 
     The given store is used to search for files that link to any of the paths that
-    are keys in the dictionary, so that ReplaceHrefEditCmd instances can be generated for them.
+    are keys in the dictionary (with a single call to :meth:`notesdir.repos.base.Repo.info_many`),
+    so that ReplaceHrefEditCmd instances can be generated for them.
     The files that are being renamed will also be checked for outbound links,
     and ReplaceRef edits will be generated for those too.
 
     Source paths may be directories; the directory as a whole will be moved, and links
     to/from all files/folders within it will be updated too.
     """
+    realpaths = {}
     to_move = {os.path.realpath(s): os.path.realpath(d) for s, d in renames.items()}
     all_moves = {}
     for src, dest in to_move.items():
         all_moves[src] = dest
         if os.path.isdir(src):
-            for path in glob(os.path.join(src, '**', '*'), recursive=True):
+            for path in _descendant_paths(src):
                 all_moves[path] = os.path.join(dest, os.path.relpath(path, src))
 
+    infos = store.info_many(all_moves, FileInfoReq(path=True, links=True, backlinks=True))
     for src, dest in all_moves.items():
-        info = store.info(src, FileInfoReq(path=True, links=True, backlinks=True))
+        info = infos[src]
         if info:
             for link in info.links:
                 referent = link.referent()
@@ -155,13 +237,13 @@ def edits_for_rearrange(store: Repo, renames: Dict[str, str]) -> Iterator[FileEd
                 elif os.path.isabs(url.path):
                     # Don't try to rewrite absolute paths, unless they refer to a file we're moving.
                     continue
-                newhref = path_as_href(href_path(dest, referent), url)
+                newhref = path_as_href(_href_path(dest, referent, realpaths), url)
                 if not link.href == newhref:
                     yield ReplaceHrefCmd(src, link.href, newhref)
         for link in info.backlinks:
             if link.referrer in all_moves:
                 continue
             # TODO either pass in all the hrefs at once, or change method to not take in a set
-            yield from edits_for_path_replacement(link.referrer, {link.href}, dest)
+            yield from edits_for_path_replacement(link.referrer, {link.href}, dest, realpaths)
 
     yield from edits_for_raw_moves(to_move)
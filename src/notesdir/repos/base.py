@@ -4,7 +4,7 @@ The most important class is :class:`Repo`.
 """
 
 from datetime import datetime
-from typing import Dict, List, Iterator, Set
+from typing import Dict, Iterable, List, Iterator, Set
 
 from notesdir.models import FileInfo, FileEditCmd, MoveCmd, FileQuery, SetTitleCmd, SetCreatedCmd, AddTagCmd,\
     DelTagCmd, ReplaceHrefCmd, FileInfoReq, FileInfoReqIsh, FileQueryIsh, CreateCmd
@@ -28,6 +28,14 @@ class Repo:
         """
         raise NotImplementedError()
 
+    def info_many(self, paths: Iterable[str], fields: FileInfoReqIsh = FileInfoReq.internal()) -> Dict[str, FileInfo]:
+        """Looks up the specified fields for each of the given files or folders, as with :meth:`info`.
+
+        Returns a dict keyed by the paths exactly as they were given. Repos may override this to share work between
+        the lookups, such as a single scan for backlinks.
+        """
+        return {path: self.info(path, fields) for path in paths}
+
     def change(self, edits: List[FileEditCmd]) -> None:
         """Applies the specified edits and saves the affected files. Changes are applied in order.
 
@@ -90,11 +98,14 @@ class Repo:
 
 def _group_edits(edits: List[FileEditCmd]) -> List[List[FileEditCmd]]:
     group = None
+    group_path = None
     result = []
     for edit in edits:
-        if group and edit.path == group[0].path and not isinstance(edit, (CreateCmd, MoveCmd)):
+        path = edit.path
+        if group and path == group_path and not isinstance(edit, (CreateCmd, MoveCmd)):
             group.append(edit)
         else:
             group = [edit]
+            group_path = path
             result.append(group)
     return result
@@ -2,28 +2,100 @@
 
 import dataclasses
 from operator import attrgetter
-from collections import defaultdict, namedtuple
+from collections import Counter, deque, namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import mmap
 import os
 import os.path
-from typing import List, Dict, Iterator, Set
+import re
+import threading
+from typing import Callable, Iterable, List, Dict, Iterator, Set, Optional, Tuple, TypeVar
 
 from notesdir.accessors.delegating import DelegatingAccessor
 from notesdir.conf import DirectRepoConf
-from notesdir.models import FileInfo, FileEditCmd, MoveCmd, FileQuery, FileInfoReq, FileInfoReqIsh,\
+from notesdir.models import FileInfo, LinkInfo, FileEditCmd, MoveCmd, FileQuery, FileInfoReq, FileInfoReqIsh,\
     FileQueryIsh, CreateCmd
 from notesdir.repos.base import Repo, _group_edits
 
 
 PathEntry = namedtuple('PathEntry', ['dir_entry', 'skip_parse'])
 
+T = TypeVar('T')
+R = TypeVar('R')
+
+# Maximum number of parsed files whose info is kept in memory by each DirectRepo.
+_PARSE_CACHE_SIZE = 4096
+
+# Files at least this large are searched through mmap instead of being read into memory.
+_MMAP_THRESHOLD = 64 * 1024
+
+# Patterns of bytes that must appear in a file for the accessor for its extension to find any links in it.
+# (HTML attribute names are case-insensitive, but cannot be written as character references.)
+# Files with any other extension are handled by accessors that never find links (see DelegatingAccessor).
+_LINK_MARKER_RES = {
+    '.md': re.compile(rb'\]\(|\]:'),
+    '.html': re.compile(rb'(?i)href|src'),
+}
+
+
+def _may_contain_links(path: str) -> bool:
+    """Returns False if the file certainly contains no links, so that it does not need to be parsed.
+
+    Files whose accessor does not support links, such as images, videos and PDFs, are not opened at all.
+    """
+    regex = _LINK_MARKER_RES.get(os.path.splitext(path)[1])
+    if regex is None:
+        return False
+    try:
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size < _MMAP_THRESHOLD:
+                return regex.search(file.read()) is not None
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return regex.search(data) is not None
+    except OSError:
+        # let the parser decide how to handle the file
+        return True
+
+
+def _parallel_map(fn: Callable[[T], R], items: Iterable[T], max_workers: Optional[int] = None) -> Iterator[R]:
+    """Applies the function to each item using a thread pool, yielding results in the same order as the items.
+
+    Only a limited number of calls are queued at once, so the items are consumed lazily.
+    """
+    if max_workers is None:
+        max_workers = min(32, (os.cpu_count() or 1) + 4)
+    if max_workers <= 1:
+        yield from map(fn, items)
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= max_workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _is_empty_dir(path: str) -> bool:
+    with os.scandir(path) as entries:
+        return next(entries, None) is None
+
+
+def _copy_info(info: FileInfo) -> FileInfo:
+    return dataclasses.replace(info, links=list(info.links), tags=set(info.tags), backlinks=list(info.backlinks))
+
 
 class DirectRepo(Repo):
-    """Accesses notes directly on the filesystem without any caching.
+    """Accesses notes directly on the filesystem without any persistent caching.
 
     This performs fine if you only have a few dozen notes, but beyond that you want a caching implementation
     (see :class:`notesdir.repos.sqlite.SqliteRepo`), because looking up backlinks for a file requires reading all
     the other files, which gets very slow.
 
+    Each instance keeps the parsed info of recently used files in memory, and reuses it as long as the file's
+    modification time, change time and size have not changed.
+
     .. attribute:: conf
        :type: DirectRepoConf
     """
@@ -32,6 +104,8 @@ class DirectRepo(Repo):
         if not conf.root_paths:
             raise ValueError('`root_paths` must be non-empty in RepoConf.')
         self.accessor_factory = DelegatingAccessor
+        self._parse_cache = OrderedDict()
+        self._parse_cache_lock = threading.Lock()
 
     def _should_skip_parse(self, path: str) -> bool:
         parent, basename = os.path.split(path)
@@ -51,57 +125,139 @@ class DirectRepo(Repo):
             skip_parse = self._should_skip_parse(path)
         fields = FileInfoReq.parse(fields)
 
-        if skip_parse or not os.path.exists(path):
+        if skip_parse:
             info = FileInfo(path)
         else:
-            try:
-                info = self.accessor_factory(path).info()
-            except Exception as ex:
-                raise IOError(f'Unable to parse {path}') from ex
+            info = self._parse(path)
 
         if fields.backlinks:
-            for other in self.query(fields=FileInfoReq(path=True, links=True)):
-                info.backlinks.extend(link for link in other.links if link.referent() == path)
+            info.backlinks.extend(link for _, link in self._backlinks({path}))
             info.backlinks.sort(key=attrgetter('referrer', 'href'))
 
         return info
 
+    def info_many(self, paths: Iterable[str], fields: FileInfoReqIsh = FileInfoReq.internal()) -> Dict[str, FileInfo]:
+        """Looks up the specified fields for each of the given files or folders, as with :meth:`info`.
+
+        The files are parsed in parallel, and backlinks for all of them are found with a single pass over the repo.
+        """
+        fields = FileInfoReq.parse(fields)
+        paths = list(paths)
+        resolved = [os.path.abspath(path) for path in paths]
+        ownfields = dataclasses.replace(fields, backlinks=False)
+        infos = dict(zip(resolved, _parallel_map(lambda p: self.info(p, ownfields, path_resolved=True), resolved,
+                                                 self.conf.max_workers)))
+        if fields.backlinks:
+            for referent, link in self._backlinks(set(resolved)):
+                infos[referent].backlinks.append(link)
+            for info in infos.values():
+                info.backlinks.sort(key=attrgetter('referrer', 'href'))
+        return {path: infos[rpath] for path, rpath in zip(paths, resolved)}
+
+    def _parse(self, path: str) -> FileInfo:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return FileInfo(path)
+        cache = self._parse_cache
+        # ctime is included because on filesystems with coarse mtimes, a same-size edit may not change the mtime.
+        key = (stat.st_ctime_ns, stat.st_mtime_ns, stat.st_size)
+        if cache is not None:
+            with self._parse_cache_lock:
+                cached = cache.get(path)
+                if cached and cached[0] == key:
+                    cache.move_to_end(path)
+                    return _copy_info(cached[1])
+        try:
+            info = self.accessor_factory(path).info()
+        except Exception as ex:
+            raise IOError(f'Unable to parse {path}') from ex
+        if cache is not None:
+            with self._parse_cache_lock:
+                cache[path] = (key, _copy_info(info))
+                cache.move_to_end(path)
+                if len(cache) > _PARSE_CACHE_SIZE:
+                    cache.popitem(last=False)
+        return info
+
+    def _backlinks(self, targets: Set[str]) -> Iterator[Tuple[str, LinkInfo]]:
+        """Yields each link from any file to one of the given paths, along with the path it refers to.
+
+        Files are read, parsed and checked on a thread pool (see :attr:`notesdir.conf.DirectRepoConf.max_workers`),
+        and only the matching links are kept. Files that contain no link syntax at all are skipped without being
+        parsed. Files are not skipped based on the names of the targets, since a link may reach a target through a
+        symlink with a different name, even one outside the root paths or in an ignored folder.
+        """
+        candidates = [e.dir_entry.path for e in self._paths() if not e.skip_parse]
+        linkreq = FileInfoReq(path=True, links=True)
+
+        def find_links(otherpath):
+            if not _may_contain_links(otherpath):
+                return []
+            links = self.info(otherpath, linkreq, path_resolved=True, skip_parse=False).links
+            result = []
+            for link in links:
+                referent = link.referent()
+                if referent in targets:
+                    result.append((referent, link))
+            return result
+
+        for links in _parallel_map(find_links, candidates, self.conf.max_workers):
+            yield from links
+
     def change(self, edits: List[FileEditCmd]):
-        for group in _group_edits(edits):
-            if self.conf.preview_mode:
-                for edit in group:
-                    print(edit)
-                continue
-
-            if isinstance(group[0], MoveCmd):
-                for edit in group:
-                    if edit.create_parents:
-                        parent = os.path.split(edit.dest)[0]
-                        os.makedirs(parent, exist_ok=True)
-                    os.rename(edit.path, edit.dest)
-                    if edit.delete_empty_parents:
-                        prev = edit.path
-                        parent = os.path.split(prev)[0]
-                        while parent and not parent == prev:
-                            if os.path.exists(parent):
-                                if sum(1 for _ in os.listdir(parent)):
-                                    break
-                                os.rmdir(parent)
-                            prev = parent
-                            parent = os.path.split(parent)[0]
-            elif isinstance(group[0], CreateCmd):
-                for edit in group:
-                    with open(edit.path, 'w') as file:
-                        file.write(edit.contents)
-            else:
-                acc = self.accessor_factory(group[0].path)
-                for edit in group:
-                    acc.edit(edit)
-                acc.save()
+        # The edits are iterated again below to decide what to invalidate, so a generator must not be consumed here.
+        edits = list(edits)
+        try:
+            for group in _group_edits(edits):
+                if self.conf.preview_mode:
+                    for edit in group:
+                        print(edit)
+                    continue
+
+                if isinstance(group[0], MoveCmd):
+                    for edit in group:
+                        if edit.create_parents:
+                            parent = os.path.split(edit.dest)[0]
+                            os.makedirs(parent, exist_ok=True)
+                        os.rename(edit.path, edit.dest)
+                        if edit.delete_empty_parents:
+                            prev = edit.path
+                            parent = os.path.split(prev)[0]
+                            while parent and not parent == prev:
+                                if os.path.exists(parent):
+                                    if not _is_empty_dir(parent):
+                                        break
+                                    os.rmdir(parent)
+                                prev = parent
+                                parent = os.path.split(parent)[0]
+                elif isinstance(group[0], CreateCmd):
+                    for edit in group:
+                        with open(edit.path, 'w', encoding='utf-8') as file:
+                            file.write(edit.contents)
+                else:
+                    acc = self.accessor_factory(group[0].path)
+                    for edit in group:
+                        acc.edit(edit)
+                    acc.save()
+        finally:
+            if not self.conf.preview_mode:
+                self.invalidate({e.path for e in edits}.union(e.dest for e in edits if isinstance(e, MoveCmd)))
 
     def invalidate(self, only: Set[str] = None):
-        """No-op."""
-        pass
+        """Discards in-memory parse results for the given paths (and anything inside them, if they are folders),
+        or for all paths if ``only`` is None."""
+        if self._parse_cache is None:
+            return
+        with self._parse_cache_lock:
+            if only is None:
+                self._parse_cache.clear()
+                return
+            for path in only:
+                self._parse_cache.pop(path, None)
+            prefixes = tuple(os.path.join(path, '') for path in only)
+            for path in [p for p in self._parse_cache if p.startswith(prefixes)]:
+                del self._parse_cache[path]
 
     def _paths(self) -> Iterator[PathEntry]:
         for root in self.conf.root_paths:
@@ -111,31 +267,55 @@ class DirectRepo(Repo):
                 yield from self._paths_in(root, skip_parse=skip_parse)
 
     def _paths_in(self, dirpath: str, skip_parse: bool) -> Iterator[PathEntry]:
-        for entry in os.scandir(dirpath):
-            if entry.is_symlink():
-                continue
-            if self.conf.ignore(dirpath, entry.name):
-                continue
-            entry_skip_parse = skip_parse or self.conf.skip_parse(dirpath, entry.name)
-            if entry.is_dir():
-                yield from self._paths_in(entry.path, skip_parse=entry_skip_parse)
-            else:
-                yield PathEntry(entry, skip_parse=entry_skip_parse)
+        # This walks the tree with an explicit stack rather than recursion, so that each yielded entry does not have
+        # to pass back up through one generator per directory level. Entries are yielded in the same order as a
+        # recursive walk would yield them.
+        ignore = self.conf.ignore
+        should_skip_parse = self.conf.skip_parse
+        stack = [(dirpath, skip_parse, os.scandir(dirpath))]
+        try:
+            while stack:
+                parent, parent_skip_parse, entries = stack[-1]
+                for entry in entries:
+                    if entry.is_symlink():
+                        continue
+                    if ignore(parent, entry.name):
+                        continue
+                    entry_skip_parse = parent_skip_parse or should_skip_parse(parent, entry.name)
+                    if entry.is_dir():
+                        stack.append((entry.path, entry_skip_parse, os.scandir(entry.path)))
+                        break
+                    yield PathEntry(entry, skip_parse=entry_skip_parse)
+                else:
+                    stack.pop()
+                    entries.close()
+        finally:
+            for _, _, entries in stack:
+                entries.close()
 
     def query(self, query: FileQueryIsh = FileQuery(), fields: FileInfoReqIsh = FileInfoReq.internal())\
             -> Iterator[FileInfo]:
-        fields = dataclasses.replace(FileInfoReq.parse(fields),
-                                     tags=(fields.tags or query.include_tags or query.exclude_tags))
         query = FileQuery.parse(query)
-        filtered = query.apply_filtering(
-            self.info(e.dir_entry.path, fields, path_resolved=True, skip_parse=e.skip_parse)
-            for e in self._paths())
+        fields = FileInfoReq.parse(fields)
+        fields = dataclasses.replace(fields, tags=(fields.tags or query.include_tags or query.exclude_tags))
+
+        ownfields = dataclasses.replace(fields, backlinks=False)
+
+        def load(entry):
+            return self.info(entry.dir_entry.path, ownfields, path_resolved=True, skip_parse=entry.skip_parse)
+
+        filtered = list(query.apply_filtering(_parallel_map(load, self._paths(), self.conf.max_workers)))
+        if fields.backlinks:
+            infos = {info.path: info for info in filtered}
+            for referent, link in self._backlinks(set(infos)):
+                infos[referent].backlinks.append(link)
+            for info in filtered:
+                info.backlinks.sort(key=attrgetter('referrer', 'href'))
         yield from query.apply_sorting(filtered)
 
     def tag_counts(self, query: FileQueryIsh = FileQuery()) -> Dict[str, int]:
         query = FileQuery.parse(query)
-        result = defaultdict(int)
+        result = Counter()
         for info in self.query(query, FileInfoReq(path=True, tags=True)):
-            for tag in info.tags:
-                result[tag] += 1
+            result.update(info.tags)
         return result
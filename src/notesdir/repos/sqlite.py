@@ -3,23 +3,32 @@
 from collections import namedtuple
 from datetime import datetime
 import dataclasses
-from operator import attrgetter
+from functools import lru_cache
 import os.path
 import sqlite3
-from typing import List, Iterator, Set
+from typing import Dict, Iterable, List, Iterator, Set
 from notesdir.conf import SqliteRepoConf
 from notesdir.models import FileInfo, FileEditCmd, FileInfoReq, FileQuery, FileQueryIsh, FileInfoReqIsh,\
     LinkInfo
-from notesdir.repos.direct import DirectRepo
+from notesdir.repos.direct import DirectRepo, _parallel_map
 
 
+# Increment this whenever _SQL_CREATE_SCHEMA changes; caches created with a different version are rebuilt.
+_SCHEMA_VERSION = 2
+
+_SQL_DROP_SCHEMA = """
+DROP TABLE IF EXISTS file_links;
+DROP TABLE IF EXISTS file_tags;
+DROP TABLE IF EXISTS files;
+"""
+
 _SQL_CREATE_SCHEMA = """
 CREATE TABLE IF NOT EXISTS files (
     id INTEGER PRIMARY KEY,
     path TEXT NOT NULL,
     existent BOOLEAN,
-    stat_ctime INTEGER,
-    stat_mtime INTEGER,
+    stat_ctime_ns INTEGER,
+    stat_mtime_ns INTEGER,
     stat_size INTEGER,
     title TEXT,
     created TEXT
@@ -30,10 +39,10 @@ CREATE UNIQUE INDEX IF NOT EXISTS files_index_path ON files (path);
 CREATE TABLE IF NOT EXISTS file_tags (
     file_id INTEGER NOT NULL,
     tag TEXT NOT NULL,
+    PRIMARY KEY(file_id, tag),
     FOREIGN KEY(file_id) REFERENCES files(id)
-);
+) WITHOUT ROWID;
 
-CREATE UNIQUE INDEX IF NOT EXISTS file_tags_index_file_id_tag ON file_tags (file_id, tag);
 CREATE INDEX IF NOT EXISTS file_tags_index_tag ON file_tags (tag);
 
 CREATE TABLE IF NOT EXISTS file_links (
@@ -57,26 +66,65 @@ DELETE_FROM file_refs;
 """
 
 
-_SQL_ALL_FOR_REFRESH = 'SELECT id, path, stat_ctime, stat_mtime, stat_size FROM files'
-_SqlAllForRefreshRow = namedtuple('SqlAllForRefreshRow', ['id', 'path', 'stat_ctime', 'stat_mtime', 'stat_size'])
+# Older SQLite versions limit statements to 999 bound parameters.
+_SQL_MAX_PARAMS = 999
+
+# When ordering a query's include tags, files are only counted up to this many per tag.
+_TAG_COUNT_LIMIT = 1000
+
+_SQL_ALL_FOR_REFRESH = 'SELECT id, path, stat_ctime_ns, stat_mtime_ns, stat_size FROM files'
+_SqlAllForRefreshRow = namedtuple('SqlAllForRefreshRow', ['id', 'path', 'stat_ctime_ns', 'stat_mtime_ns', 'stat_size'])
 
-_SQL_INSERT_FILE = ('INSERT INTO files (path, existent, stat_ctime, stat_mtime, stat_size, title, created)'
+_SQL_INSERT_FILE = ('INSERT INTO files (path, existent, stat_ctime_ns, stat_mtime_ns, stat_size, title, created)'
                     ' VALUES (?, ?, ?, ?, ?, ?, ?)')
-_SqlInsertFileRow = namedtuple('SqlInsertFileRow', ['path', 'existent', 'stat_ctime', 'stat_mtime', 'stat_size',
+_SqlInsertFileRow = namedtuple('SqlInsertFileRow', ['path', 'existent', 'stat_ctime_ns', 'stat_mtime_ns', 'stat_size',
                                                     'title', 'created'])
 
-_SQL_UPDATE_FILE = ('UPDATE files SET existent = ?, stat_ctime = ?, stat_mtime = ?, stat_size = ?,'
+_SQL_UPDATE_FILE = ('UPDATE files SET existent = ?, stat_ctime_ns = ?, stat_mtime_ns = ?, stat_size = ?,'
                     ' title = ?, created = ?'
                     ' WHERE id = ?')
-_SqlUpdateFileRow = namedtuple('SqlUpdateFileRow', ['existent', 'stat_ctime', 'stat_mtime', 'stat_size',
+_SqlUpdateFileRow = namedtuple('SqlUpdateFileRow', ['existent', 'stat_ctime_ns', 'stat_mtime_ns', 'stat_size',
                                                     'title', 'created', 'id'])
 
 
+@lru_cache(maxsize=256)
+def _sql_filter_files(include_count: int, exclude_count: int) -> str:
+    """Returns a WHERE condition selecting the existent files that match a query's tag filters.
+
+    The query's include tags and then its exclude tags must be bound to the placeholders, in that order.
+    Only the number of tags affects the SQL, so queries with the same shape share the same statement text,
+    which also lets sqlite3 reuse its prepared statement.
+
+    Files having all the include tags are found by joining file_tags to itself once per tag. CROSS JOIN keeps
+    SQLite from reordering the joins, so only the first include tag's rows are scanned and each other tag is an index
+    lookup; see :meth:`SqliteRepo._by_selectivity`.
+    """
+    sql = 'existent = TRUE'
+    if include_count:
+        joins = ''.join(f' CROSS JOIN file_tags t{i}' for i in range(1, include_count))
+        conditions = ''.join(f' AND t{i}.file_id = t0.file_id AND t{i}.tag = ?' for i in range(1, include_count))
+        sql += f' AND id IN (SELECT t0.file_id FROM file_tags t0{joins} WHERE t0.tag = ?{conditions})'
+    if exclude_count:
+        marks = ', '.join('?' * exclude_count)
+        sql += f' AND id NOT IN (SELECT file_id FROM file_tags WHERE tag IN ({marks}))'
+    return sql
+
+
+def _fetch_ids(cursor: sqlite3.Cursor, paths: List[str], ids_by_path: Dict[str, int]) -> None:
+    """Looks up the ids of the given paths in the files table and adds them to the dict."""
+    for i in range(0, len(paths), _SQL_MAX_PARAMS):
+        chunk = paths[i:i + _SQL_MAX_PARAMS]
+        cursor.execute(f'SELECT path, id FROM files WHERE path IN ({",".join("?" * len(chunk))})', chunk)
+        ids_by_path.update(cursor.fetchall())
+
+
 class SqliteRepo(DirectRepo):
     """Keeps a cache of note metadata/links in a SQLite database.
 
     The database file is only a cache: you can safely delete it and it will be rebuilt the next time you create a
     :class:`SqliteRepo` instance. Corrupting or deleting the file during operation may cause erratic behavior, though.
+    The database is opened in write-ahead log mode, which keeps ``-wal`` and ``-shm`` files beside it; see
+    :attr:`notesdir.conf.SqliteRepoConf.cache_path`.
 
     The modification timestamp and other filesystem metadata for each file in your note directories
     are stored in the database. Each time a :class:`SqliteRepo` instance is created or :meth:`change` is
@@ -90,6 +138,8 @@ class SqliteRepo(DirectRepo):
     """
     def __init__(self, conf: SqliteRepoConf):
         super().__init__(conf)
+        # Files are only reparsed when their stat info changes, so an in-memory cache would never be hit.
+        self._parse_cache = None
         if not conf.cache_path:
             raise ValueError('`cache_path` must be set in SqliteRepoConf.')
         self.connection = None
@@ -98,7 +148,16 @@ class SqliteRepo(DirectRepo):
 
     def _connect(self):
         self.connection = sqlite3.connect(self.conf.cache_path)
+        # The database is only a cache that can be rebuilt from the notes, so trading durability for fewer fsyncs
+        # is fine. WAL with synchronous=NORMAL still keeps the file consistent if the process is killed.
+        self.connection.executescript('PRAGMA journal_mode = WAL;'
+                                      ' PRAGMA synchronous = NORMAL;'
+                                      ' PRAGMA temp_store = MEMORY;')
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if not version == _SCHEMA_VERSION:
+            self.connection.executescript(_SQL_DROP_SCHEMA)
         self.connection.executescript(_SQL_CREATE_SCHEMA)
+        self.connection.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
 
     def _refresh(self) -> None:
         cursor = self.connection.cursor()
@@ -108,85 +167,108 @@ class SqliteRepo(DirectRepo):
         found_paths = set()
 
         ids_by_path = {}
-        links_to_add = []
-
-        for path_entry in self._paths():
-            dir_entry = path_entry.dir_entry
-            pathstr = dir_entry.path
-            found_paths.add(pathstr)
-            row = prior_rows_by_path.get(pathstr)
-            if row and path_entry.skip_parse:
-                # TODO currently we do not clear out old data for files that were previously parsable but are now
-                #      marked skip_parse
-                continue
-            stat = dir_entry.stat()
-            if (row and row.stat_ctime == stat.st_ctime
-                    and row.stat_mtime == stat.st_mtime
-                    and row.stat_size == stat.st_size):
-                continue
-            info = super().info(pathstr, path_resolved=True, skip_parse=path_entry.skip_parse)
+        reparsed_ids = []
+        file_inserts = []
+        file_updates = []
+        tag_paths = []
+        tags = []
+        link_referrers = []
+        link_referents = []
+        link_hrefs = []
+
+        def changed_entries():
+            for path_entry in self._paths():
+                dir_entry = path_entry.dir_entry
+                pathstr = dir_entry.path
+                found_paths.add(pathstr)
+                row = prior_rows_by_path.get(pathstr)
+                if row and path_entry.skip_parse:
+                    # TODO currently we do not clear out old data for files that were previously parsable but are now
+                    #      marked skip_parse
+                    continue
+                stat = dir_entry.stat()
+                if (row and row.stat_ctime_ns == stat.st_ctime_ns
+                        and row.stat_mtime_ns == stat.st_mtime_ns
+                        and row.stat_size == stat.st_size):
+                    continue
+                yield path_entry, row, stat
+
+        parse = super().info
+
+        def parse_entry(changed):
+            path_entry, row, stat = changed
+            info = parse(path_entry.dir_entry.path, path_resolved=True, skip_parse=path_entry.skip_parse)
+            return row, stat, info, [link.referent() for link in info.links]
+
+        # Files are parsed (and their links resolved) on a thread pool, but all database writes stay on this thread.
+        for row, stat, info, referents in _parallel_map(parse_entry, changed_entries(), self.conf.max_workers):
+            pathstr = info.path
             if row:
                 file_id = row.id
-                cursor.execute('DELETE FROM file_tags WHERE file_id = ?', (file_id,))
-                cursor.execute('DELETE FROM file_links WHERE referrer_id = ?', (file_id,))
+                reparsed_ids.append((file_id,))
                 updrow = _SqlUpdateFileRow(id=file_id,
                                            existent=True,
-                                           stat_ctime=stat.st_ctime,
-                                           stat_mtime=stat.st_mtime,
+                                           stat_ctime_ns=stat.st_ctime_ns,
+                                           stat_mtime_ns=stat.st_mtime_ns,
                                            stat_size=stat.st_size,
                                            title=info.title,
                                            created=info.created)
-                cursor.execute(_SQL_UPDATE_FILE, updrow)
+                file_updates.append(updrow)
+                ids_by_path[pathstr] = file_id
             else:
                 newrow = _SqlInsertFileRow(path=pathstr,
                                            existent=True,
-                                           stat_ctime=stat.st_ctime,
-                                           stat_mtime=stat.st_mtime,
+                                           stat_ctime_ns=stat.st_ctime_ns,
+                                           stat_mtime_ns=stat.st_mtime_ns,
                                            stat_size=stat.st_size,
                                            title=info.title,
                                            created=info.created)
-                cursor.execute(_SQL_INSERT_FILE, newrow)
-                file_id = cursor.lastrowid
-            cursor.executemany('INSERT INTO file_tags (file_id, tag) VALUES (?, ?)',
-                               ((file_id, t) for t in info.tags))
-            ids_by_path[pathstr] = file_id
-            links_to_add.extend((file_id, link) for link in info.links)
-
-        for referrer_id, link in links_to_add:
-            referent_id = None
-            referent = link.referent()
-            if referent:
-                referent_str = str(referent)
-                found_paths.add(referent_str)
-                referent_id = ids_by_path.get(referent_str)
-                if not referent_id:
-                    prior_row = prior_rows_by_path.get(referent_str)
-                    if prior_row:
-                        referent_id = prior_row.id
-                if not referent_id:
-                    cursor.execute('INSERT INTO files (path, existent) VALUES (?, FALSE)', (referent_str,))
-                    referent_id = cursor.lastrowid
-                    ids_by_path[referent_str] = referent_id
-            cursor.execute('INSERT INTO file_links (referrer_id, referent_id, href)'
-                           ' VALUES (?, ?, ?)',
-                           (referrer_id, referent_id, link.href))
+                file_inserts.append(newrow)
+            # New files do not have ids yet, so tags and links are collected by path and resolved to ids below.
+            tag_paths.extend(pathstr for _ in info.tags)
+            tags.extend(info.tags)
+            link_referrers.extend(pathstr for _ in info.links)
+            link_referents.extend(referents)
+            link_hrefs.extend(link.href for link in info.links)
+
+        cursor.executemany(_SQL_UPDATE_FILE, file_updates)
+        cursor.executemany(_SQL_INSERT_FILE, file_inserts)
+        _fetch_ids(cursor, [r.path for r in file_inserts], ids_by_path)
+        cursor.executemany('DELETE FROM file_tags WHERE file_id = ?', reparsed_ids)
+        cursor.executemany('DELETE FROM file_links WHERE referrer_id = ?', reparsed_ids)
+        cursor.executemany('INSERT INTO file_tags (file_id, tag) VALUES (?, ?)',
+                           zip((ids_by_path[p] for p in tag_paths), tags))
+
+        referent_paths = {r for r in link_referents if r}
+        found_paths.update(referent_paths)
+        for row in prior_rows_by_path.values():
+            ids_by_path.setdefault(row.path, row.id)
+        missing_paths = list(referent_paths.difference(ids_by_path))
+        if missing_paths:
+            cursor.executemany('INSERT OR IGNORE INTO files (path, existent) VALUES (?, FALSE)',
+                               ((p,) for p in missing_paths))
+            _fetch_ids(cursor, missing_paths, ids_by_path)
+        link_referrer_ids = [ids_by_path[r] for r in link_referrers]
+        link_referent_ids = [r and ids_by_path[r] for r in link_referents]
+        cursor.executemany('INSERT INTO file_links (referrer_id, referent_id, href) VALUES (?, ?, ?)',
+                           zip(link_referrer_ids, link_referent_ids, link_hrefs))
 
         ids_to_delete = [prior_rows_by_path[p].id for p in set(prior_rows_by_path.keys()).difference(found_paths)]
-        for id_to_delete in ids_to_delete:
-            cursor.execute('SELECT COUNT(*) FROM file_links WHERE referent_id = ?', (id_to_delete,))
-            if cursor.fetchone()[0] == 0:
-                cursor.execute('DELETE FROM files WHERE id = ?', (id_to_delete,))
-            else:
-                updrow = _SqlUpdateFileRow(id=id_to_delete,
-                                           existent=False,
-                                           stat_ctime=None,
-                                           stat_mtime=None,
-                                           stat_size=None,
-                                           title=None,
-                                           created=None)
-                cursor.execute(_SQL_UPDATE_FILE, updrow)
-            cursor.execute('DELETE FROM file_tags WHERE file_id = ?', (id_to_delete,))
-            cursor.execute('DELETE FROM file_links WHERE referrer_id = ?', (id_to_delete,))
+        # Files that are still linked to are kept, but marked nonexistent, so the links can be looked up later.
+        referenced_ids = set()
+        for i in range(0, len(ids_to_delete), _SQL_MAX_PARAMS):
+            chunk = ids_to_delete[i:i + _SQL_MAX_PARAMS]
+            cursor.execute('SELECT DISTINCT referent_id FROM file_links'
+                           f' WHERE referent_id IN ({",".join("?" * len(chunk))})', chunk)
+            referenced_ids.update(r[0] for r in cursor)
+        cursor.executemany('DELETE FROM files WHERE id = ?',
+                           ((i,) for i in ids_to_delete if i not in referenced_ids))
+        cursor.executemany(_SQL_UPDATE_FILE,
+                           (_SqlUpdateFileRow(id=i, existent=False, stat_ctime_ns=None, stat_mtime_ns=None,
+                                              stat_size=None, title=None, created=None)
+                            for i in ids_to_delete if i in referenced_ids))
+        cursor.executemany('DELETE FROM file_tags WHERE file_id = ?', ((i,) for i in ids_to_delete))
+        cursor.executemany('DELETE FROM file_links WHERE referrer_id = ?', ((i,) for i in ids_to_delete))
 
         self.connection.commit()
         self._needs_refresh = False
@@ -205,42 +287,106 @@ class SqliteRepo(DirectRepo):
             path = os.path.abspath(path)
         fields = FileInfoReq.parse(fields)
         cursor = self.connection.cursor()
-        cursor.execute('SELECT id, title, created FROM files WHERE path = ?', (path,))
+        cursor.execute('SELECT id, path, title, created FROM files WHERE path = ?', (path,))
         file_row = cursor.fetchone()
-        info = FileInfo(path)
-        if file_row:
-            file_id = file_row[0]
-            info.title = file_row[1]
-            info.created = file_row[2] and datetime.fromisoformat(file_row[2])
+        if not file_row:
+            return FileInfo(path)
+        return self._load_infos(cursor, fields, [file_row])[0]
+
+    def _load_infos(self, cursor: sqlite3.Cursor, fields: FileInfoReq, rows: List[tuple]) -> List[FileInfo]:
+        """Returns info for each of the given (id, path, title, created) rows from the files table, in the same order.
+
+        Rather than running separate queries for each file, this runs one query per table for every
+        chunk of (up to 999) files.
+        """
+        infos_by_id = {file_id: FileInfo(path, title=title, created=created and datetime.fromisoformat(created))
+                       for file_id, path, title, created in rows}
+        ids = list(infos_by_id)
+        for i in range(0, len(ids), _SQL_MAX_PARAMS):
+            chunk = ids[i:i + _SQL_MAX_PARAMS]
+            marks = ','.join('?' * len(chunk))
             if fields.tags:
-                cursor.execute('SELECT tag FROM file_tags WHERE file_id = ?', (file_id,))
-                info.tags = {r[0] for r in cursor}
+                cursor.execute(f'SELECT file_id, tag FROM file_tags WHERE file_id IN ({marks})', chunk)
+                for file_id, tag in cursor:
+                    infos_by_id[file_id].tags.add(tag)
             if fields.links:
-                cursor.execute('SELECT href FROM file_links WHERE referrer_id = ?', (file_id,))
-                info.links = [LinkInfo(path, href) for href in sorted(r[0] for r in cursor)]
+                # SQLite's default BINARY collation orders UTF-8 text the same way Python orders str.
+                cursor.execute(f'SELECT referrer_id, href FROM file_links WHERE referrer_id IN ({marks})'
+                               ' ORDER BY href', chunk)
+                for file_id, href in cursor:
+                    info = infos_by_id[file_id]
+                    info.links.append(LinkInfo(info.path, href))
             if fields.backlinks:
-                cursor.execute('SELECT referrers.path, file_links.href'
+                cursor.execute('SELECT file_links.referent_id, referrers.path, file_links.href'
                                ' FROM files referrers'
                                '  INNER JOIN file_links ON referrers.id = file_links.referrer_id'
-                               ' WHERE file_links.referent_id = ?',
-                               (file_id,))
-                info.backlinks = [LinkInfo(referrer, href) for referrer, href in cursor]
-                info.backlinks.sort(key=attrgetter('referrer', 'href'))
-        return info
+                               f' WHERE file_links.referent_id IN ({marks})'
+                               ' ORDER BY referrers.path, file_links.href',
+                               chunk)
+                for file_id, referrer, href in cursor:
+                    infos_by_id[file_id].backlinks.append(LinkInfo(referrer, href))
+        return list(infos_by_id.values())
+
+    def _by_selectivity(self, tags: Set[str]) -> List[str]:
+        """Returns the tags ordered from the fewest files to the most, which is the best order for joining on them.
+
+        Each tag's files are only counted up to :data:`_TAG_COUNT_LIMIT`, using the index on file_tags.tag, so this
+        stays cheap even for tags that are on most files.
+        """
+        if len(tags) < 2:
+            return list(tags)
+        cursor = self.connection.cursor()
+        counts = {}
+        for tag in tags:
+            cursor.execute('SELECT COUNT(*) FROM (SELECT 1 FROM file_tags WHERE tag = ? LIMIT ?)',
+                           (tag, _TAG_COUNT_LIMIT))
+            counts[tag] = cursor.fetchone()[0]
+        return sorted(tags, key=counts.get)
+
+    def info_many(self, paths: Iterable[str], fields: FileInfoReqIsh = FileInfoReq.internal()) -> Dict[str, FileInfo]:
+        """Looks up the specified fields for each of the given files or folders, as with :meth:`info`.
+
+        The files are looked up in chunks of (up to 999) paths, and their details are loaded with one query per table
+        for each chunk.
+        """
+        self._refresh_if_needed()
+        fields = FileInfoReq.parse(fields)
+        paths = list(paths)
+        resolved = [os.path.abspath(path) for path in paths]
+        infos = {path: FileInfo(path) for path in resolved}
+        unique = list(infos)
+        cursor = self.connection.cursor()
+        for i in range(0, len(unique), _SQL_MAX_PARAMS):
+            chunk = unique[i:i + _SQL_MAX_PARAMS]
+            cursor.execute(f'SELECT id, path, title, created FROM files WHERE path IN ({",".join("?" * len(chunk))})',
+                           chunk)
+            for info in self._load_infos(cursor, fields, cursor.fetchall()):
+                infos[info.path] = info
+        return {path: infos[rpath] for path, rpath in zip(paths, resolved)}
 
     def query(self, query: FileQueryIsh = FileQuery(), fields: FileInfoReqIsh = FileInfoReq.internal())\
             -> Iterator[FileInfo]:
         self._refresh_if_needed()
         query = FileQuery.parse(query)
+        fields = FileInfoReq.parse(fields)
+        fields = dataclasses.replace(fields, tags=(fields.tags or query.include_tags or query.exclude_tags))
         cursor = self.connection.cursor()
-        cursor.execute('SELECT path FROM files WHERE existent = TRUE')
-        # TODO: Obviously, this is super lazy and inefficient. We should do as much filtering and data loading in
-        #       the query as we reasonably can.
-        fields = dataclasses.replace(FileInfoReq.parse(fields),
-                                     tags=(fields.tags or query.include_tags or query.exclude_tags))
-        filtered = query.apply_filtering(self.info(path, fields, path_resolved=True) for (path,) in cursor)
+        sql = _sql_filter_files(len(query.include_tags), len(query.exclude_tags))
+        cursor.execute(f'SELECT id, path, title, created FROM files WHERE {sql}',
+                       [*self._by_selectivity(query.include_tags), *query.exclude_tags])
+        filtered = query.apply_filtering(self._load_infos(cursor, fields, cursor.fetchall()))
         yield from query.apply_sorting(filtered)
 
+    def tag_counts(self, query: FileQueryIsh = FileQuery()) -> Dict[str, int]:
+        self._refresh_if_needed()
+        query = FileQuery.parse(query)
+        sql = _sql_filter_files(len(query.include_tags), len(query.exclude_tags))
+        cursor = self.connection.cursor()
+        cursor.execute(f'SELECT tag, COUNT(*) FROM file_tags WHERE file_id IN (SELECT id FROM files WHERE {sql})'
+                       ' GROUP BY tag',
+                       [*self._by_selectivity(query.include_tags), *query.exclude_tags])
+        return dict(cursor.fetchall())
+
     def change(self, edits: List[FileEditCmd]):
         try:
             super().change(edits)
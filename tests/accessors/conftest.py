@@ -0,0 +1,11 @@
+import pytest
+from notesdir.accessors.markdown import MarkdownAccessor
+
+
+@pytest.fixture
+def make_md(fs):
+    """Returns a function that writes the given document to a fake file and returns an accessor for it."""
+    def make(doc: str, path: str = '/fakenotes/test.md') -> MarkdownAccessor:
+        fs.create_file(path, contents=doc)
+        return MarkdownAccessor(path)
+    return make
@@ -1,7 +1,9 @@
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
+import pytest
 from bs4 import BeautifulSoup
 from notesdir.models import AddTagCmd, DelTagCmd, FileInfo, SetTitleCmd, SetCreatedCmd, ReplaceHrefCmd, LinkInfo
+from notesdir.accessors.base import ParseError
 from notesdir.accessors.html import HTMLAccessor
 
 
@@ -15,6 +17,37 @@ def test_info_garbage(fs):
     assert info == FileInfo(str(path))
 
 
+def test_info_empty(fs):
+    path = Path('/fakenotes/test.html')
+    fs.create_file(path, contents='')
+    assert HTMLAccessor(str(path)).info() == FileInfo(str(path))
+
+
+def test_info_empty_created(fs):
+    path = Path('/fakenotes/test.html')
+    fs.create_file(path, contents='<html><head><meta name="created" content=""/></head></html>')
+    assert HTMLAccessor(str(path)).info() == FileInfo(str(path))
+
+
+def test_info_not_utf8(fs):
+    path = Path('/fakenotes/test.html')
+    fs.create_file(path, contents='<html><head><title>Café</title></head></html>', encoding='iso-8859-1')
+    with pytest.raises(ParseError):
+        HTMLAccessor(str(path)).info()
+
+
+def test_change_utf8(fs):
+    path = Path('/fakenotes/test.html')
+    fs.create_file(path, contents='<html><head><title>Café</title></head><body>ü</body></html>', encoding='utf-8')
+    acc = HTMLAccessor(str(path))
+    assert acc.info().title == 'Café'
+    acc.edit(AddTagCmd(str(path), 'crème'))
+    assert acc.info().title == 'Café'
+    assert acc.save()
+    assert 'crème' in path.read_text(encoding='utf-8')
+    assert HTMLAccessor(str(path)).info().title == 'Café'
+
+
 def test_info(fs):
     doc = """<html>
     <head>
@@ -52,6 +52,12 @@ a link to [another file](another-file) and
     assert _replace_href(doc, 'some-file', 'new-ref') == expected
 
 
+def test_replace_href_inline_same_line():
+    doc = "[one](some-file) and [two](some-file)\nbut not ](some-file) without an opening bracket"
+    expected = "[one](new-ref) and [two](new-ref)\nbut not ](some-file) without an opening bracket"
+    assert _replace_href(doc, 'some-file', 'new-ref') == expected
+
+
 def test_replace_href_refstyle():
     doc = """Here we see the ref style syntax:
 [some id]: file-1 "Some Text"
@@ -80,7 +86,7 @@ def test_replace_href_replacement_string_special_characters():
     assert _replace_href(doc, 'foo.md', '2-foo\\3.md') == expected
 
 
-def test_info(fs):
+def test_info(make_md):
     doc = """---
 title: An Examination of the Navel
 created: 2019-06-04 10:12:13-08:00
@@ -93,9 +99,9 @@ keywords:
 As I have explained at length in [another note](../Another%20Note.md) and also
 published about online (see [this article](http://example.com/blah) among many others), ...
 """
-    path = '/fakenotes/test.md'
-    fs.create_file(path, contents=doc)
-    info = MarkdownAccessor(path).info()
+    acc = make_md(doc)
+    path = acc.path
+    info = acc.info()
     assert info.path == path
     assert info.links == [LinkInfo(path, r) for r in sorted(['../Another%20Note.md', 'http://example.com/blah'])]
     assert info.tags == {'trulyprofound', 'personal', 'book-draft', 'journaling'}
@@ -103,7 +109,7 @@ published about online (see [this article](http://example.com/blah) among many o
     assert info.created == datetime(2019, 6, 4, 10, 12, 13, 0, timezone(timedelta(hours=-8)))
 
 
-def test_change(fs):
+def test_change(make_md):
     doc = """---
 title: An Examination of the Navel
 ---
@@ -127,9 +133,8 @@ As I have explained at length in [another note](moved/another-note.md) and also
 published about online (see [this article](http://example.com/blahblah) and
 [this one](https://example.com/meh) among many others), ...
 """
-    path = '/fakenotes/test.md'
-    fs.create_file(path, contents=doc)
-    acc = MarkdownAccessor(path)
+    acc = make_md(doc)
+    path = acc.path
     acc.edit(ReplaceHrefCmd(path, '../Another%20Note.md', 'moved/another-note.md'))
     acc.edit(ReplaceHrefCmd(path, 'http://example.com/blah', 'https://example.com/meh'))
     acc.edit(SetTitleCmd(path, 'A Close Examination of the Navel'))
@@ -138,7 +143,17 @@ published about online (see [this article](http://example.com/blahblah) and
     assert Path(path).read_text() == expected
 
 
-def test_change_metadata_tags(fs):
+def test_change_swap_hrefs(make_md):
+    acc = make_md('[a](one.md) [b](two.md)\n[c]: one.md')
+    path = acc.path
+    acc.edit(ReplaceHrefCmd(path, 'one.md', 'two.md'))
+    acc.edit(ReplaceHrefCmd(path, 'two.md', 'one.md'))
+    assert acc.info().links == [LinkInfo(path, 'one.md'), LinkInfo(path, 'two.md'), LinkInfo(path, 'two.md')]
+    assert acc.save()
+    assert Path(path).read_text() == '[a](two.md) [b](one.md)\n[c]: two.md'
+
+
+def test_change_metadata_tags(make_md):
     doc = """---
 keywords:
 - one
@@ -153,30 +168,46 @@ keywords:
 ---
 
 text"""
-    path = '/fakenotes/test.md'
-    fs.create_file(path, contents=doc)
-    acc = MarkdownAccessor(path)
+    acc = make_md(doc)
+    path = acc.path
     acc.edit(AddTagCmd(path, 'THREE'))
     acc.edit(DelTagCmd(path, 'ONE'))
     assert acc.save()
     assert Path(path).read_text() == expected
 
 
-def test_remove_hashtag(fs):
+def test_change_noop(make_md):
+    doc = """---
+keywords:
+- one
+title: Same
+---
+
+text"""
+    acc = make_md(doc)
+    path = acc.path
+    acc.edit(AddTagCmd(path, 'ONE'))
+    acc.edit(SetTitleCmd(path, 'Same'))
+    acc.edit(ReplaceHrefCmd(path, 'missing.md', 'other.md'))
+    assert not acc.save()
+    assert acc.meta['keywords'] == ['one']
+    assert Path(path).read_text() == doc
+
+
+def test_remove_hashtag(make_md):
     doc = '#Tag1 tag1 #tag1. tag1#tag1 #tag1 #tag2 #tag1'
     # TODO Currently none of the whitespace around a tag is removed when the tag is, which can leave things
     #      pretty ugly. But I'm not sure what the best approach is.
     expected = ' tag1 . tag1#tag1  #tag2 '
-    path = '/fakenotes/test.md'
-    fs.create_file(path, contents=doc)
-    acc = MarkdownAccessor(path)
+    acc = make_md(doc)
+    path = acc.path
     assert acc.info().tags == {'tag1', 'tag2'}
     acc.edit(DelTagCmd(path, 'tag1'))
     assert acc.save()
     assert Path(path).read_text() == expected
 
 
-def test_ignore_fenced_code_blocks(fs):
+def test_ignore_fenced_code_blocks(make_md):
     doc = """#tag1 [link](link1.md)
 ```foo
 #tag2 #tag3
@@ -187,9 +218,8 @@ text [link](link1.md)
    ```
    [link](link3.md)
    ```"""
-    path = '/fakenotes/text.md'
-    fs.create_file(path, contents=doc)
-    acc = MarkdownAccessor(path)
+    acc = make_md(doc, '/fakenotes/text.md')
+    path = acc.path
     info = acc.info()
     assert info.tags == {'tag1', 'tag3'}
     assert info.links == [LinkInfo(path, 'link1.md'), LinkInfo(path, 'link2.md')]
@@ -1,4 +1,8 @@
+import os
+from typing import Dict
+
 from freezegun.api import FakeDatetime
+import pytest
 import yaml
 from yaml.dumper import SafeDumper
 from yaml.representer import SafeRepresenter
@@ -6,3 +10,20 @@ from yaml.representer import SafeRepresenter
 
 def pytest_configure():
     SafeDumper.add_representer(FakeDatetime, SafeRepresenter.represent_datetime)
+    if hasattr(yaml, 'CSafeDumper'):
+        yaml.CSafeDumper.add_representer(FakeDatetime, SafeRepresenter.represent_datetime)
+
+
+@pytest.fixture
+def tree(fs):
+    """Returns a function that creates files from a dict of paths to contents in the fake filesystem.
+
+    Each parent directory is only created once, no matter how many of the files are in it.
+    """
+    def make(files: Dict[str, str]):
+        for parent in sorted({os.path.dirname(path) for path in files}):
+            if not fs.exists(parent):
+                fs.create_dir(parent)
+        for path, contents in files.items():
+            fs.create_file(path, contents=contents, create_missing_dirs=False)
+    return make
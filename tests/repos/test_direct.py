@@ -1,30 +1,62 @@
 import os.path
 from pathlib import Path
+from freezegun import freeze_time
 from notesdir.conf import DirectRepoConf
-from notesdir.models import SetTitleCmd, ReplaceHrefCmd, MoveCmd, FileQuery, FileInfo, FileInfoReq, LinkInfo
+from notesdir.models import SetTitleCmd, ReplaceHrefCmd, MoveCmd, FileQuery, FileInfo, FileInfoReq, LinkInfo,\
+    CreateCmd
+from notesdir.repos.base import _group_edits
+from notesdir.repos.direct import _parallel_map
 
 
-def test_info_directory(fs):
-    path = Path('/notes/foo/bar')
+def test_info_directory(tmp_path):
+    path = tmp_path / 'notes' / 'foo' / 'bar'
     path.mkdir(parents=True, exist_ok=True)
-    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    repo = DirectRepoConf(root_paths={str(tmp_path / 'notes')}).instantiate()
     assert repo.info(str(path)) == FileInfo(str(path))
     assert repo.info(str(path.parent)) == FileInfo(str(path.parent))
 
 
-def test_info_nonexistent(fs):
-    path = '/notes/foo'
-    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+def test_info_nonexistent(tmp_path):
+    path = str(tmp_path / 'notes' / 'foo')
+    repo = DirectRepoConf(root_paths={str(tmp_path / 'notes')}).instantiate()
     assert repo.info(path) == FileInfo(path)
 
 
-def test_backlinks(fs):
+def test_info_cached(fs):
+    path = '/notes/one.md'
+    fs.create_file(path, contents='#tag1')
+    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    info = repo.info(path)
+    assert info.tags == {'tag1'}
+    info.tags.add('bogus')
+    assert repo.info(path).tags == {'tag1'}
+    Path(path).write_text('#tag1 #tag2')
+    assert repo.info(path).tags == {'tag1', 'tag2'}
+
+
+@freeze_time('2012-05-02T03:04:05Z')
+def test_invalidate(tree):
+    # With the clock frozen, same-size writes leave the stat info unchanged, so cached info stays until invalidated.
+    tree({'/notes/dir/one.md': '#tag1', '/notes/dirtwo.md': '#tag2'})
+    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    assert {i.path: i.tags for i in repo.query()} == {'/notes/dir/one.md': {'tag1'}, '/notes/dirtwo.md': {'tag2'}}
+    Path('/notes/dir/one.md').write_text('#tag3')
+    Path('/notes/dirtwo.md').write_text('#tag4')
+    assert repo.info('/notes/dir/one.md').tags == {'tag1'}
+    repo.invalidate({'/notes/dir'})
+    assert repo.info('/notes/dir/one.md').tags == {'tag3'}
+    assert repo.info('/notes/dirtwo.md').tags == {'tag2'}
+    repo.invalidate()
+    assert repo.info('/notes/dirtwo.md').tags == {'tag4'}
+
+
+def test_backlinks(fs, tree):
+    tree({'/notes/foo/subject.md': '',
+          '/notes/bar/baz/r1.md': '[1](no) [2](../../foo/subject.md)',
+          '/notes/bar/baz/no.md': '[3](../../foo/bogus',
+          '/notes/r2.md': '[4](foo/subject.md) [5](foo/bogus)',
+          '/notes/foo/r3.md': '[6](subject.md)'})
     fs.cwd = '/notes/foo'
-    fs.create_file('/notes/foo/subject.md')
-    fs.create_file('/notes/bar/baz/r1.md', contents='[1](no) [2](../../foo/subject.md)')
-    fs.create_file('/notes/bar/baz/no.md', contents='[3](../../foo/bogus')
-    fs.create_file('/notes/r2.md', contents='[4](foo/subject.md) [5](foo/bogus)')
-    fs.create_file('/notes/foo/r3.md', contents='[6](subject.md)')
     repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
     info = repo.info('subject.md', 'backlinks')
     assert info.backlinks == [
@@ -34,6 +66,94 @@ def test_backlinks(fs):
     ]
 
 
+def test_backlinks_special_characters(tree):
+    tree({'/notes/hi there!.md': '',
+          '/notes/r1.md': '[1](hi%20there%21.md)',
+          '/notes/r2.md': '[2](hi+there!.md)',
+          '/notes/r3.md': '[3](other.md)',
+          '/notes/my~note.md': '',
+          '/notes/r4.md': '[4](my%7Enote.md)',
+          '/notes/r5.html': '<html><body><a href="my&#126;note.md">5</a></body></html>',
+          '/notes/r6.md': '[6](%6Dy~note.md)'})
+    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    info = repo.info('/notes/hi there!.md', 'backlinks')
+    assert info.backlinks == [
+        LinkInfo('/notes/r1.md', 'hi%20there%21.md'),
+        LinkInfo('/notes/r2.md', 'hi+there!.md'),
+    ]
+    info = repo.info('/notes/my~note.md', 'backlinks')
+    assert info.backlinks == [
+        LinkInfo('/notes/r4.md', 'my%7Enote.md'),
+        LinkInfo('/notes/r5.html', 'my~note.md'),
+        LinkInfo('/notes/r6.md', '%6Dy~note.md'),
+    ]
+
+
+def test_backlinks_skips_files_without_link_support(tree, mocker):
+    tree({'/notes/subject.md': '',
+          '/notes/r1.md': '[1](subject.md)',
+          '/notes/movie.mp4': '[2](subject.md)',
+          '/notes/paper.pdf': '[3](subject.md)'})
+    opened = mocker.patch('notesdir.repos.direct.open', create=True, side_effect=open)
+    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    repo.accessor_factory = mocker.Mock(side_effect=repo.accessor_factory)
+    info = repo.info('/notes/subject.md', 'backlinks')
+    assert info.backlinks == [LinkInfo('/notes/r1.md', 'subject.md')]
+    assert {c.args[0] for c in opened.call_args_list} == {'/notes/subject.md', '/notes/r1.md'}
+    assert {c.args[0] for c in repo.accessor_factory.call_args_list} == {'/notes/subject.md', '/notes/r1.md'}
+
+
+def test_info_many(tree):
+    tree({'/notes/one.md': '[1](two.md) [2](three.md) [3](#top)',
+          '/notes/two.md': '[4](three.md)',
+          '/notes/three.md': '#tag1',
+          '/notes/other.md': '[5](other.md)'})
+    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    infos = repo.info_many(['/notes/one.md', '/notes/two.md', '/notes/three.md'], FileInfoReq.full())
+    assert infos == {path: repo.info(path, FileInfoReq.full()) for path in infos}
+    assert infos['/notes/one.md'].backlinks == [LinkInfo('/notes/one.md', '#top')]
+    assert infos['/notes/two.md'].backlinks == [LinkInfo('/notes/one.md', 'two.md')]
+    assert infos['/notes/three.md'].backlinks == [LinkInfo('/notes/one.md', 'three.md'),
+                                                  LinkInfo('/notes/two.md', 'three.md')]
+
+
+def test_backlinks_through_symlink(fs, tree):
+    tree({'/notes/subject.md': '',
+          '/notes/r1.md': '[1](alias.md)',
+          '/notes/r2.md': '[2](linked/subject.md) [3](subject.md)',
+          '/notes/r3.md': '[4](other.md)'})
+    fs.create_symlink('/notes/alias.md', '/notes/subject.md')
+    fs.create_symlink('/notes/linked', '/notes')
+    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    info = repo.info('/notes/subject.md', 'backlinks')
+    assert info.backlinks == [
+        LinkInfo('/notes/r1.md', 'alias.md'),
+        LinkInfo('/notes/r2.md', 'linked/subject.md'),
+        LinkInfo('/notes/r2.md', 'subject.md'),
+    ]
+
+
+def test_backlinks_through_unwalked_symlink(fs, tree):
+    tree({'/notes/subject.md': '',
+          '/notes/r1.md': '[1](../outside/alias.md)',
+          '/notes/r2.md': '[2](.hidden/alias.md)',
+          '/notes/r3.md': '[3](other.md)'})
+    fs.create_symlink('/outside/alias.md', '/notes/subject.md')
+    fs.create_symlink('/notes/.hidden/alias.md', '/notes/subject.md')
+    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    info = repo.info('/notes/subject.md', 'backlinks')
+    assert info.backlinks == [
+        LinkInfo('/notes/r1.md', '../outside/alias.md'),
+        LinkInfo('/notes/r2.md', '.hidden/alias.md'),
+    ]
+
+
+def test_parallel_map():
+    expected = [i * 2 for i in range(100)]
+    assert list(_parallel_map(lambda i: i * 2, iter(range(100)), 4)) == expected
+    assert list(_parallel_map(lambda i: i * 2, iter(range(100)), 1)) == expected
+
+
 def test_referrers_self(fs):
     fs.create_file('/notes/subject.md', contents='[1](subject.md)')
     repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
@@ -41,9 +161,8 @@ def test_referrers_self(fs):
     assert info.backlinks == [LinkInfo('/notes/subject.md', 'subject.md')]
 
 
-def test_change(fs):
-    fs.create_file('/notes/one.md', contents='[1](old)')
-    fs.create_file('/notes/two.md', contents='[2](foo)')
+def test_change(tree):
+    tree({'/notes/one.md': '[1](old)', '/notes/two.md': '[2](foo)'})
     edits = [SetTitleCmd('/notes/one.md', 'New Title'),
              ReplaceHrefCmd('/notes/one.md', 'old', 'new'),
              MoveCmd('/notes/one.md', '/notes/moved.md'),
@@ -55,13 +174,41 @@ def test_change(fs):
     assert Path('/notes/two.md').read_text() == '[2](bar)'
 
 
-def test_change_directories(fs):
+def test_change_create_utf8(fs):
+    fs.create_dir('/notes')
+    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    repo.change([CreateCmd('/notes/new.md', '# Caf\u00e9 \u2192 na\u00efve')])
+    assert Path('/notes/new.md').read_bytes() == '# Caf\u00e9 \u2192 na\u00efve'.encode('utf-8')
+
+
+@freeze_time('2012-05-02T03:04:05Z')
+def test_change_generator(tree):
+    # With the clock frozen, a same-size edit leaves the file's stat info unchanged, so only invalidation by change()
+    # can keep the parse cache from returning the old links.
+    tree({'/notes/one.md': '[1](a.md)'})
+    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    assert repo.info('/notes/one.md').links == [LinkInfo('/notes/one.md', 'a.md')]
+    repo.change(e for e in [ReplaceHrefCmd('/notes/one.md', 'a.md', 'b.md')])
+    assert Path('/notes/one.md').read_text() == '[1](b.md)'
+    assert repo.info('/notes/one.md').links == [LinkInfo('/notes/one.md', 'b.md')]
+
+
+def test_group_edits():
+    edits = [SetTitleCmd('/a.md', 'A'),
+             ReplaceHrefCmd('/a.md', 'x', 'y'),
+             MoveCmd('/a.md', '/b.md'),
+             MoveCmd('/b.md', '/c.md'),
+             CreateCmd('/d.md', ''),
+             ReplaceHrefCmd('/e.md', 'x', 'y'),
+             SetTitleCmd('/a.md', 'A')]
+    assert _group_edits(edits) == [edits[0:2], [edits[2]], [edits[3]], [edits[4]], [edits[5]], [edits[6]]]
+
+
+def test_change_directories(tree):
     paths1 = ['/notes/dir1/subdir1/one.md', '/notes/dir2/subdir2/two.md',
              '/notes/dir2/subdir3/three.md']
     nonmovingpath = '/notes/dir2/subdir3/four.md'
-    for path in paths1:
-        fs.create_file(path)
-    fs.create_file(nonmovingpath)
+    tree({p: '' for p in paths1 + [nonmovingpath]})
     paths2 = [p.replace('/notes/', '/notes/newdir/') for p in paths1]
     repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
     edits = [MoveCmd(paths1[i], paths2[i], create_parents=True, delete_empty_parents=True) for i in range(3)]
@@ -73,10 +220,10 @@ def test_change_directories(fs):
     assert os.path.exists(nonmovingpath)
 
 
-def test_query(fs):
-    fs.create_file('/notes/one.md', contents='#tag1 #tag1 #tag2 #tag4')
-    fs.create_file('/notes/two.md', contents='#tag1 #tag3')
-    fs.create_file('/notes/three.md', contents='#tag1 #tag3 #tag4')
+def test_query(tree):
+    tree({'/notes/one.md': '#tag1 #tag1 #tag2 #tag4',
+          '/notes/two.md': '#tag1 #tag3',
+          '/notes/three.md': '#tag1 #tag3 #tag4'})
     repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
     paths = {i.path for i in repo.query(FileQuery())}
     assert paths == {'/notes/one.md', '/notes/two.md', '/notes/three.md'}
@@ -96,20 +243,30 @@ def test_query(fs):
     assert [os.path.basename(i.path) for i in repo.query('sort:filename')] == ['one.md', 'three.md', 'two.md']
 
 
-def test_tag_counts(fs):
-    fs.create_file('/notes/one.md', contents='#tag1 #tag1 #tag2')
-    fs.create_file('/notes/two.md', contents='#tag1 #tag3')
-    fs.create_file('/notes/three.md', contents='#tag1 #tag3 #tag4')
+def test_query_backlinks(tree):
+    tree({'/notes/one.md': '#tag1 [1](two.md) [2](three.md)',
+          '/notes/two.md': '#tag1 [3](three.md)',
+          '/notes/three.md': '[4](two.md)'})
+    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    infos = list(repo.query('tag:tag1 sort:filename', 'path,backlinks'))
+    assert [i.path for i in infos] == ['/notes/one.md', '/notes/two.md']
+    assert infos[0].backlinks == []
+    assert infos[1].backlinks == [LinkInfo('/notes/one.md', 'two.md'), LinkInfo('/notes/three.md', 'two.md')]
+
+
+def test_tag_counts(tree):
+    tree({'/notes/one.md': '#tag1 #tag1 #tag2',
+          '/notes/two.md': '#tag1 #tag3',
+          '/notes/three.md': '#tag1 #tag3 #tag4'})
     repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
     assert repo.tag_counts(FileQuery()) == {'tag1': 3, 'tag2': 1, 'tag3': 2, 'tag4': 1}
     assert repo.tag_counts(FileQuery.parse('tag:tag3')) == {'tag1': 2, 'tag3': 2, 'tag4': 1}
 
 
-def test_ignore(fs):
+def test_ignore(tree):
     path1 = '/notes/one.md'
     path2 = '/notes/.two.md'
-    fs.create_file(path1, contents='I link to [two](.two.md)')
-    fs.create_file(path2, contents='I link to [one](one.md)')
+    tree({path1: 'I link to [two](.two.md)', path2: 'I link to [one](one.md)'})
     repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
     assert list(repo.query()) == [repo.info(path1)]
     assert not repo.info(path1, FileInfoReq.full()).backlinks
@@ -120,15 +277,15 @@ def test_ignore(fs):
     assert repo.info(path2, FileInfoReq.full()).backlinks == [LinkInfo(path1, '.two.md')]
 
 
-def test_skip_parse(fs):
+def test_skip_parse(tree):
     path1 = '/notes/one.md'
     path2 = '/notes/one.md.resources/two.md'
     path3 = '/notes/skip.md'
     path4 = '/notes/unskip.md'
-    fs.create_file(path1, contents='---\ntitle: Note One\n...\n')
-    fs.create_file(path2, contents='---\ntitle: Note Two\n...\n')
-    fs.create_file(path3, contents='---\ntitle: Note Skip\n...\n')
-    fs.create_file(path4, contents='---\ntitle: Note No Skip\n...\n')
+    tree({path1: '---\ntitle: Note One\n...\n',
+          path2: '---\ntitle: Note Two\n...\n',
+          path3: '---\ntitle: Note Skip\n...\n',
+          path4: '---\ntitle: Note No Skip\n...\n'})
 
     def fn(parentpath, filename):
         return filename.endswith('.resources') or filename == 'skip.md'
@@ -1,5 +1,7 @@
 from datetime import datetime
 from pathlib import Path
+import sqlite3
+import pytest
 from notesdir.models import FileInfo, FileQuery, SetTitleCmd, ReplaceHrefCmd, MoveCmd, FileInfoReq, LinkInfo
 from notesdir.conf import SqliteRepoConf
 
@@ -12,13 +14,28 @@ def test_init():
     config().instantiate().close()
 
 
-def test_info_unknown(fs):
-    fs.create_file('/notes/one.md', contents='Hello')
-    repo = config().instantiate()
-    assert repo.info('/notes/two.md') == FileInfo('/notes/two.md')
+def test_rebuilds_outdated_cache(tmp_path):
+    cache_path = str(tmp_path / 'cache.sqlite')
+    connection = sqlite3.connect(cache_path)
+    connection.execute('CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT NOT NULL)')
+    connection.commit()
+    connection.close()
+    conf = SqliteRepoConf(root_paths={str(tmp_path / 'notes')}, cache_path=cache_path)
+    with conf.instantiate() as repo:
+        assert repo.connection.execute('PRAGMA user_version').fetchone()[0] > 0
+        assert list(repo.query()) == []
+
 
+def test_info_unknown(tmp_path):
+    notes = tmp_path / 'notes'
+    notes.mkdir()
+    (notes / 'one.md').write_text('Hello')
+    path = str(notes / 'two.md')
+    repo = SqliteRepoConf(root_paths={str(notes)}, cache_path=':memory:').instantiate()
+    assert repo.info(path) == FileInfo(path)
 
-def test_info_and_referrers(fs):
+
+def test_info_and_referrers(tree):
     doc = """---
 title: A Note
 created: 2012-01-02 03:04:05
@@ -27,8 +44,7 @@ I link to [two](two.md) and [three](../otherdir/three.md#heading) and have #two
     path1 = '/notes/dir/one.md'
     path2 = '/notes/dir/two.md'
     path3 = '/notes/otherdir/three.md'
-    fs.create_file(path1, contents=doc)
-    fs.create_file(path2, contents='---\ntitle: Note 2\n...\n')
+    tree({path1: doc, path2: '---\ntitle: Note 2\n...\n'})
     repo = config().instantiate()
     assert repo.info(path1, FileInfoReq.full()) == FileInfo(
         path1,
@@ -42,6 +58,8 @@ I link to [two](two.md) and [three](../otherdir/three.md#heading) and have #two
         backlinks=[LinkInfo(path1, 'two.md')])
     assert repo.info(path3, FileInfoReq.full()) == FileInfo(path3,
                                                             backlinks=[LinkInfo(path1, '../otherdir/three.md#heading')])
+    paths = [path1, path2, path3, '/notes/bogus.md']
+    assert repo.info_many(paths, FileInfoReq.full()) == {p: repo.info(p, FileInfoReq.full()) for p in paths}
 
 
 def test_duplicate_links(fs):
@@ -68,45 +86,60 @@ def test_invalidate(fs):
     assert repo.info(path, FileInfoReq.full()) == FileInfo(path, tags={'goodbye'})
 
 
-def test_query(fs):
-    fs.create_file('/notes/one.md', contents='#tag1 #tag1 #tag2 #tag4')
-    fs.create_file('/notes/two.md', contents='#tag1 #tag3')
-    fs.create_file('/notes/three.md', contents='#tag1 #tag3 #tag4')
-    repo = config().instantiate()
-    paths = {i.path for i in repo.query(FileQuery())}
-    assert paths == {'/notes/one.md', '/notes/two.md', '/notes/three.md'}
-    paths = {i.path for i in repo.query(FileQuery.parse('tag:tag3'))}
-    assert paths == {'/notes/two.md', '/notes/three.md'}
-    paths = {i.path for i in repo.query(FileQuery.parse('tag:tag1,tag4'))}
-    assert paths == {'/notes/one.md', '/notes/three.md'}
-    assert not list(repo.query(FileQuery.parse('tag:bogus')))
-    paths = {i.path for i in repo.query(FileQuery.parse('-tag:tag2'))}
-    assert paths == {'/notes/two.md', '/notes/three.md'}
-    paths = {i.path for i in repo.query(FileQuery.parse('-tag:tag2,tag4'))}
-    assert paths == {'/notes/two.md'}
-    assert not list(repo.query(FileQuery.parse('-tag:tag1')))
-    paths = {i.path for i in repo.query(FileQuery.parse('tag:tag3 -tag:tag4'))}
-    assert paths == {'/notes/two.md'}
-
-    assert [Path(i.path).name for i in repo.query('sort:filename')] == ['one.md', 'three.md', 'two.md']
-
-
-def test_tag_counts(fs):
-    fs.create_file('/notes/one.md', contents='#tag1 #tag1 #tag2')
-    fs.create_file('/notes/two.md', contents='#tag1 #tag3')
-    fs.create_file('/notes/three.md', contents='#tag1 #tag3 #tag4')
+@pytest.fixture(scope='module')
+def query_repo(tmp_path_factory):
+    # Shared by the query tests below, which only read from it. This uses a real temporary folder since the fs fixture
+    # is per-test.
+    notes = tmp_path_factory.mktemp('notes')
+    (notes / 'one.md').write_text('#tag1 #tag1 #tag2 #tag4')
+    (notes / 'two.md').write_text('#tag1 #tag3')
+    (notes / 'three.md').write_text('#tag1 #tag3 #tag4')
+    with SqliteRepoConf(root_paths={str(notes)}, cache_path=':memory:').instantiate() as repo:
+        list(repo.query())
+        yield repo
+
+
+@pytest.mark.parametrize('query,expected', [
+    (FileQuery(), {'one.md', 'two.md', 'three.md'}),
+    (FileQuery.parse('tag:tag3'), {'two.md', 'three.md'}),
+    (FileQuery.parse('tag:tag1,tag4'), {'one.md', 'three.md'}),
+    (FileQuery.parse('tag:bogus'), set()),
+    (FileQuery.parse('-tag:tag2'), {'two.md', 'three.md'}),
+    (FileQuery.parse('-tag:tag2,tag4'), {'two.md'}),
+    (FileQuery.parse('-tag:tag1'), set()),
+    (FileQuery.parse('tag:tag3 -tag:tag4'), {'two.md'}),
+])
+def test_query(query_repo, query, expected):
+    assert {Path(i.path).name for i in query_repo.query(query)} == expected
+
+
+def test_query_fields_and_sorting(query_repo):
+    assert [(Path(i.path).name, i.tags) for i in query_repo.query('tag:tag2', 'path')] == [
+        ('one.md', {'tag1', 'tag2', 'tag4'})]
+    assert [Path(i.path).name for i in query_repo.query('sort:filename')] == ['one.md', 'three.md', 'two.md']
+
+
+def test_by_selectivity(query_repo):
+    assert query_repo._by_selectivity({'tag1', 'tag2', 'tag3', 'bogus'}) == ['bogus', 'tag2', 'tag3', 'tag1']
+
+
+def test_tag_counts(tree):
+    tree({'/notes/one.md': '#tag1 #tag1 #tag2',
+          '/notes/two.md': '#tag1 #tag3',
+          '/notes/three.md': '#tag1 #tag3 #tag4'})
     repo = config().instantiate()
     assert repo.tag_counts(FileQuery()) == {'tag1': 3, 'tag2': 1, 'tag3': 2, 'tag4': 1}
     assert repo.tag_counts(FileQuery.parse('tag:tag3')) == {'tag1': 2, 'tag3': 2, 'tag4': 1}
+    assert repo.tag_counts(FileQuery.parse('-tag:tag2')) == {'tag1': 2, 'tag3': 2, 'tag4': 1}
+    assert repo.tag_counts(FileQuery.parse('tag:bogus')) == {}
 
 
-def test_change(fs):
-    fs.cwd = '/notes'
+def test_change(fs, tree):
     path1 = '/notes/one.md'
     path2 = '/notes/two.md'
     path3 = '/notes/moved.md'
-    fs.create_file(path1, contents='[1](old)')
-    fs.create_file(path2, contents='[2](foo)')
+    tree({path1: '[1](old)', path2: '[2](foo)'})
+    fs.cwd = '/notes'
     edits = [SetTitleCmd(path1, 'New Title'),
              ReplaceHrefCmd(path1, 'old', 'new'),
              MoveCmd(path1, path3),
@@ -116,13 +149,14 @@ def test_change(fs):
     assert not Path(path1).exists()
     assert Path(path3).read_text() == '---\ntitle: New Title\n---\n\n[1](new)'
     assert Path(path2).read_text() == '[2](bar)'
-    assert repo.info(path1, FileInfoReq.full()) == FileInfo(path1)
-    assert repo.info(path3, FileInfoReq.full()) == FileInfo(path3, title='New Title', links=[LinkInfo(path3, 'new')])
-    assert repo.info(path2, FileInfoReq.full()) == FileInfo(path2, links=[LinkInfo(path2, 'bar')])
-    assert repo.info('old', FileInfoReq.full()) == FileInfo('/notes/old')
-    assert repo.info('foo', FileInfoReq.full()) == FileInfo('/notes/foo')
-    assert repo.info('new', FileInfoReq.full()) == FileInfo('/notes/new', backlinks=[LinkInfo(path3, 'new')])
-    assert repo.info('bar', FileInfoReq.full()) == FileInfo('/notes/bar', backlinks=[LinkInfo(path2, 'bar')])
+    infos = repo.info_many([path1, path2, path3, 'old', 'foo', 'new', 'bar'], FileInfoReq.full())
+    assert infos[path1] == FileInfo(path1)
+    assert infos[path3] == FileInfo(path3, title='New Title', links=[LinkInfo(path3, 'new')])
+    assert infos[path2] == FileInfo(path2, links=[LinkInfo(path2, 'bar')])
+    assert infos['old'] == FileInfo('/notes/old')
+    assert infos['foo'] == FileInfo('/notes/foo')
+    assert infos['new'] == FileInfo('/notes/new', backlinks=[LinkInfo(path3, 'new')])
+    assert infos['bar'] == FileInfo('/notes/bar', backlinks=[LinkInfo(path2, 'bar')])
     # regression test for bug where invalidate removed entries for files that were referred to
     # only by files that had not been changed
     repo.invalidate()
@@ -130,11 +164,10 @@ def test_change(fs):
     assert repo.info('bar', FileInfoReq.full()) == FileInfo('/notes/bar', backlinks=[LinkInfo(path2, 'bar')])
 
 
-def test_ignore(fs):
+def test_ignore(tree):
     path1 = '/notes/one.md'
     path2 = '/notes/.two.md'
-    fs.create_file(path1, contents='I link to [two](.two.md)')
-    fs.create_file(path2, contents='I link to [one](one.md)')
+    tree({path1: 'I link to [two](.two.md)', path2: 'I link to [one](one.md)'})
     with config().instantiate() as repo:
         assert list(repo.query()) == [repo.info(path1)]
         assert not repo.info(path1, FileInfoReq.full()).backlinks
@@ -147,15 +180,15 @@ def test_ignore(fs):
         assert repo.info(path2, FileInfoReq.full()).backlinks == [LinkInfo(path1, '.two.md')]
 
 
-def test_skip_parse(fs):
+def test_skip_parse(tree):
     path1 = '/notes/one.md'
     path2 = '/notes/one.md.resources/two.md'
     path3 = '/notes/skip.md'
     path4 = '/notes/unskip.md'
-    fs.create_file(path1, contents='---\ntitle: Note One\n...\n')
-    fs.create_file(path2, contents='---\ntitle: Note Two\n...\n')
-    fs.create_file(path3, contents='---\ntitle: Note Skip\n...\n')
-    fs.create_file(path4, contents='---\ntitle: Note No Skip\n...\n')
+    tree({path1: '---\ntitle: Note One\n...\n',
+          path2: '---\ntitle: Note Two\n...\n',
+          path3: '---\ntitle: Note Skip\n...\n',
+          path4: '---\ntitle: Note No Skip\n...\n'})
 
     def fn(parentpath, filename):
         return filename.endswith('.resources') or filename == 'skip.md'
@@ -1,10 +1,12 @@
+import os.path
 from pathlib import Path
 from urllib.parse import urlparse
 
 import pytest
 
 from notesdir.conf import DirectRepoConf
-from notesdir.rearrange import href_path, path_as_href, edits_for_rearrange
+from notesdir.models import ReplaceHrefCmd
+from notesdir.rearrange import href_path, path_as_href, edits_for_rearrange, edits_for_path_replacement, _relpath
 
 
 def test_ref_path_same_file():
@@ -85,6 +87,40 @@ def test_ref_path_symlinks_relative(fs):
     assert href_path(src, dest) == '../meh/hello'
 
 
+def test_ref_path_same_dir_symlink(fs):
+    fs.create_file('/real/target')
+    fs.create_symlink('/foo/link', '/real/target')
+    fs.create_symlink('/foo/srclink', '/real/src')
+    assert href_path('/foo/bar', '/foo/link') == '../real/target'
+    assert href_path('/foo/srclink', '/foo/baz') == '../foo/baz'
+
+
+def test_path_replacement_shares_realpaths(fs):
+    fs.create_symlink('/notes/link', '/real')
+    realpaths = {}
+    assert list(edits_for_path_replacement('/notes/a/one.md', {'old.md'}, '/notes/link/new.md', realpaths)) == [
+        ReplaceHrefCmd('/notes/a/one.md', 'old.md', '../../real/new.md')]
+    assert realpaths == {'/notes/a/one.md': '/notes/a/one.md', '/notes/link/new.md': '/real/new.md'}
+    realpaths['/notes/link/new.md'] = '/cached/new.md'
+    assert list(edits_for_path_replacement('/notes/two.md', {'old.md'}, '/notes/link/new.md', realpaths)) == [
+        ReplaceHrefCmd('/notes/two.md', 'old.md', '../cached/new.md')]
+
+
+@pytest.mark.parametrize('path,start', [
+    ('/', '/'),
+    ('/foo', '/'),
+    ('/', '/foo/bar'),
+    ('/foo/bar', '/foo/bar'),
+    ('/foo/bar/baz', '/foo'),
+    ('/foo', '/foo/bar/baz'),
+    ('/foo/bar', '/foo/baz'),
+    ('/foo/bar', '/foobar'),
+    ('/a/b/c', '/x/y'),
+])
+def test_relpath(path, start):
+    assert _relpath(path, start) == os.path.relpath(path, start)
+
+
 def test_path_as_ref_absolute():
     assert path_as_href('/foo/bar/baz') == '/foo/bar/baz'
 
@@ -243,3 +279,14 @@ def test_rearrange_absolute_paths(fs):
     assert Path(paths[2]).read_text() == 'I am not being moved but link to something that [is](newdir/new1.md)'
     assert Path('/notes/newdir/new4.md').read_text() == 'I am being moved and so is what I link [to](new1.md)'
     assert Path('/notes/newdir/new1.md').read_text() == docs[0]
+
+
+def test_rearrange_folder_with_symlink_loop(fs):
+    fs.create_file('/notes/dir/one.md', contents='I link to [two](two.md).')
+    fs.create_file('/notes/dir/two.md')
+    fs.create_symlink('/notes/dir/loop', '/notes/dir')
+    repo = DirectRepoConf(root_paths={'/notes'}).instantiate()
+    repo.change(edits_for_rearrange(repo, {'/notes/dir': '/notes/newdir'}))
+    assert not Path('/notes/dir').exists()
+    assert Path('/notes/newdir/one.md').read_text() == 'I link to [two](two.md).'
+    assert Path('/notes/newdir/loop').is_symlink()